@@ -72,10 +72,27 @@ class Content(SearchMixin, TimeStampedModel, models.Model):
     def get_author_display(self):
         return self.author_text or str(self.author)
 
+    @classmethod
+    def get_index_queryset(cls):
+        return cls.objects.select_related('author').prefetch_related('tags')
+
+    @property
+    def index_title(self):
+        return self.title
+
     @property
     def index_strings(self):
-        return (self.title, self.text, self.author_text, str(self.author),
-                u' '.join(self.tags.names()))
+        return (self.text, self.author_text, str(self.author))
+
+    @property
+    def index_tags(self):
+        return self.tags.names()
+
+    @property
+    def index_lang(self):
+        return self.lang
+
+    index_url_name = 'blog:content_detail'
 
     @property
     def index_public(self):
@@ -169,6 +169,27 @@ USERS_LIST_EXTRA_FIELDS = ['serial']
 
 USER_INDEX_FIELDS = ['short_name', 'full_name', 'serial']
 
+# Weight of each column of the search index ('title', 'text' and 'tags') when
+# ranking results, by column name. Missing columns have a weight of 1.
+SEARCH_RANK_WEIGHTS = {'title': 4, 'tags': 2}
+
+# Queue the indexing of saved objects instead of indexing them right away.
+# The queue is then processed by the process_index_queue command.
+SEARCH_DEFERRED_INDEXING = False
+
+# SQLite FTS tokenizer of the search index. Changing it rebuilds the index on
+# the next migrate. Use 'simple' with SQLite older than 3.7.13.
+SEARCH_TOKENIZER = 'unicode61'
+
+# Number of search queries whose results are cached by each process, 0 to
+# disable the cache, and maximum age of the cached results, in seconds.
+SEARCH_CACHE_SIZE = 128
+SEARCH_CACHE_TIMEOUT = 60
+
+# Load the search results from their model tables, instead of rendering them
+# from the title, URL and preview stored in the index.
+SEARCH_HYDRATE_RESULTS = False
+
 USER_FORM_FIELDS = (
     (_('Basic informations'), ['serial', 'short_name', 'full_name']),
     (_('Language skills'), ['ar_level', 'en_level']),
@@ -61,10 +61,32 @@ class Book(SearchMixin, TimeStampedModel):
     def get_absolute_url(self):
         return reverse('library:book_detail', kwargs={'pk': self.pk})
 
+    @classmethod
+    def get_index_queryset(cls):
+        return cls.objects.prefetch_related('tags')
+
+    @property
+    def index_title(self):
+        return self.title
+
     @property
     def index_strings(self):
-        return (self.title, self.isbn, self.authors, self.subtitle,
-                self.summary, self.serie, u' '.join(self.tags.names()))
+        return (self.isbn, self.authors, self.subtitle, self.summary,
+                self.serie)
+
+    @property
+    def index_tags(self):
+        return self.tags.names()
+
+    @property
+    def index_lang(self):
+        return self.lang
+
+    index_url_name = 'library:book_detail'
+
+    @property
+    def index_preview(self):
+        return self.cover.url if self.cover else u''
 
 
 class BookSpecimen(TimeStampedModel):
@@ -13,6 +13,7 @@ from django.views.generic import (CreateView, DeleteView, DetailView, FormView,
 
 from ideascube.decorators import staff_member_required
 from ideascube.mixins import ByTagListView, CSVExportMixin
+from ideascube.search.models import deferred_indexing
 
 from .forms import BookForm, BookSpecimenForm, ImportForm
 from .models import Book, BookSpecimen
@@ -90,7 +91,8 @@ class BookImport(FormView):
             handler = form.save_from_isbn
         if handler:
             try:
-                notices = handler()
+                with deferred_indexing():
+                    notices = handler()
             except (ValueError, AssertionError) as e:
                 msg = _(u'Unable to process notices: {}'.format(str(e)))
                 messages.add_message(self.request, messages.ERROR, msg)
@@ -7,6 +7,7 @@ from django.db import models
 
 from ideascube.forms import UserForm
 from ideascube.library.forms import BookForm, BookSpecimenForm
+from ideascube.search.models import deferred_indexing
 
 
 def utf8(s):
@@ -616,12 +617,13 @@ class Command(BaseCommand):
             'USER': 'root',
         }
         print('Processing {box} data'.format(**options))
-        if 'user' in options['action']:
-            for row in Empr.objects.using('burundi').all():
-                self.process_user(row)
-        if 'book' in options['action']:
-            for row in Notices.objects.using('burundi').all():
-                self.process_notice(row)
+        with deferred_indexing():
+            if 'user' in options['action']:
+                for row in Empr.objects.using('burundi').all():
+                    self.process_user(row)
+            if 'book' in options['action']:
+                for row in Notices.objects.using('burundi').all():
+                    self.process_notice(row)
 
     def process_user(self, empr):
         attrs = ['short_name', 'full_name', 'serial', 'birth_year', 'gender',
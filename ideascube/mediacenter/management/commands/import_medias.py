@@ -12,6 +12,7 @@ from django.core.management.base import BaseCommand
 from ideascube.mediacenter.models import Document
 from ideascube.mediacenter.forms import DocumentForm
 from ideascube.mediacenter.utils import guess_kind_from_content_type
+from ideascube.search.models import deferred_indexing
 from ideascube.templatetags.ideascube_tags import smart_truncate
 
 
@@ -60,8 +61,9 @@ class Command(BaseCommand):
             self.abort('Path does not exist: {}'.format(path))
         self.ROOT = os.path.dirname(path)
         rows = self.load(path)
-        for row in rows:
-            self.add(row)
+        with deferred_indexing():
+            for row in rows:
+                self.add(row)
 
     def add(self, metadata):
         title = metadata.get('title')
@@ -84,10 +84,35 @@ class Document(SearchMixin, TimeStampedModel):
             if kind:
                 self.kind = kind
 
+    @classmethod
+    def get_index_queryset(cls):
+        return cls.objects.prefetch_related('tags')
+
+    @property
+    def index_title(self):
+        return self.title
+
     @property
     def index_strings(self):
-        return (self.title, self.summary, self.credits,
-                u' '.join(self.tags.names()))
+        return (self.summary, self.credits)
+
+    @property
+    def index_tags(self):
+        return self.tags.names()
+
+    @property
+    def index_lang(self):
+        return self.lang
+
+    @property
+    def index_kind(self):
+        return self.kind
+
+    index_url_name = 'mediacenter:document_detail'
+
+    @property
+    def index_preview(self):
+        return self.preview.url if self.preview else u''
 
     @property
     def slug(self):
@@ -135,6 +135,15 @@ def test_should_add_tags_if_given():
     assert Document.objects.get(title='my video', tags__name="tag2")
 
 
+def test_imported_tags_are_indexed():
+    metadata = ('title;summary;credits;path;tags\n'
+                'my video;my video summary;BSF;a-video.mp4;tag1,tag2')
+    write_metadata(metadata)
+    call_command('import_medias', CSV_PATH)
+    # Indexing is deferred until the form has saved the tags too.
+    assert Document.objects.search('tag2').count() == 1
+
+
 def test_should_honour_lang_if_given(settings):
     settings.LANGUAGE_CODE = 'fr'
     assert not Document.objects.count()
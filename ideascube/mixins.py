@@ -1,9 +1,9 @@
 import csv
-from io import StringIO
 from datetime import datetime
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
 from django.views.generic import ListView
 
 from taggit.models import Tag
@@ -23,27 +23,39 @@ class ByTagListView(ListView):
         return context
 
 
+class Echo(object):
+    """Pseudo file: writing returns the written value instead of storing it,
+    so that a csv writer can produce lines one at a time."""
+
+    def write(self, value):
+        return value
+
+
 class CSVExportMixin(object):
 
     prefix = 'ideascube'
 
-    def to_csv(self):
-        out = StringIO()
+    def iter_csv(self):
+        """Yield the CSV lines one by one, querysets being iterated with
+        iterator() so that their instances are not all kept in memory."""
         headers = self.get_headers()
-        writer = csv.DictWriter(out, headers)
-        writer.writeheader()
-        for item in self.get_items():
-            row = self.get_row(item)
-            writer.writerow(row)
-        out.seek(0)
-        return out.read()
+        writer = csv.DictWriter(Echo(), headers)
+        yield writer.writerow(dict(zip(headers, headers)))
+        items = self.get_items()
+        if isinstance(items, QuerySet):
+            items = items.iterator()
+        for item in items:
+            yield writer.writerow(self.get_row(item))
+
+    def to_csv(self):
+        return ''.join(self.iter_csv())
 
     def render_to_csv(self):
-        response = HttpResponse(self.to_csv())
+        response = StreamingHttpResponse(self.iter_csv(),
+                                         content_type='text/csv')
         filename = self.get_filename()
         attachment = 'attachment; filename="{name}.csv"'.format(name=filename)
         response['Content-Disposition'] = attachment
-        response['Content-Type'] = 'text/csv'
         return response
 
     def get_item(self):
@@ -140,6 +140,7 @@ class User(SearchMixin, TimeStampedModel, AbstractBaseUser):
                 for name in settings.USER_INDEX_FIELDS)
 
     index_public = False  # Searchable only by staff.
+    index_url_name = 'user_detail'
 
     OCCUPATION_CHOICES = (
         ('student', _('Student')),
@@ -275,4 +276,18 @@ class User(SearchMixin, TimeStampedModel, AbstractBaseUser):
 class SortedTaggableManager(_TaggableManager):
     def get_queryset(self, *args, **kwargs):
         qs = super().get_queryset(*args, **kwargs)
+        if self.is_prefetched():
+            # Ordering would mean a new query, sorting is done in names().
+            return qs
         return qs.order_by('name')
+
+    def is_prefetched(self):
+        try:
+            return self.is_cached(self.instance)
+        except AttributeError:  # Nothing prefetched on this instance.
+            return False
+
+    def names(self):
+        if self.is_prefetched():
+            return sorted(tag.name for tag in self.get_queryset())
+        return super().names()
@@ -6,7 +6,7 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext as _
 
-from .models import Entry, InventorySpecimen, Loan, Specimen
+from .models import DailyStat, Entry, InventorySpecimen, Loan, Specimen
 
 user_model = get_user_model()
 
@@ -51,6 +51,37 @@ class ExportLoanForm(forms.Form):
         required=False)
 
 
+class StatsForm(forms.Form):
+
+    kind = forms.ChoiceField(choices=DailyStat.KINDS, required=False)
+    since = forms.DateField(
+        widget=forms.DateInput(format='%Y-%m-%d'),
+        required=False)
+    until = forms.DateField(
+        widget=forms.DateInput(format='%Y-%m-%d'),
+        required=False)
+    group_by = forms.MultipleChoiceField(
+        choices=[('date', _('Day')), ('module', _('Module')),
+                 ('activity', _('Activity')), ('partner', _('Partner')),
+                 ('gender', _('Gender')), ('birth_decade', _('Birth decade'))],
+        required=False)
+
+    def clean_kind(self):
+        return self.cleaned_data['kind'] or DailyStat.ENTRY
+
+    def clean_group_by(self):
+        return self.cleaned_data['group_by'] or ['date', 'module']
+
+    def totals(self):
+        """Return the totals matching the cleaned data, as dicts."""
+        qs = DailyStat.objects.filter(kind=self.cleaned_data['kind'])
+        if self.cleaned_data['since']:
+            qs = qs.filter(date__gte=self.cleaned_data['since'])
+        if self.cleaned_data['until']:
+            qs = qs.filter(date__lte=self.cleaned_data['until'])
+        return qs.totals(*self.cleaned_data['group_by'])
+
+
 class SpecimenForm(forms.ModelForm):
 
     def clean_barcode(self):
@@ -128,12 +159,10 @@ class ReturnForm(forms.Form):
 
     def clean_loan(self):
         barcode = self.cleaned_data['loan']
-        try:
-            loan = Loan.objects.due().get(specimen__barcode=barcode)
-        except Loan.DoesNotExist:
+        # Several open loans should only exist after migrating from 0.3.2 to
+        # 0.3.0, the oldest one is returned first.
+        loan = Loan.objects.open_by_barcode(barcode)
+        if loan is None:
             msg = _('Item with barcode {barcode} is not loaned.')
             raise forms.ValidationError(msg.format(barcode=barcode))
-        except Loan.MultipleObjectsReturned:
-            # Should araise only after migration 0.3.2 to 0.3.0.
-            loan = Loan.objects.due().filter(specimen__barcode=barcode).first()
         return loan
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ideascube.monitoring.models import DailyStat
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily entries and loans statistics'
+
+    def handle(self, *args, **options):
+        count = DailyStat.objects.rebuild()
+        self.stdout.write('{} statistics rows.'.format(count))
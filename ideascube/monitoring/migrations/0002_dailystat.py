@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('kind', models.CharField(max_length=10, choices=[('entry', 'Entries'), ('loan', 'Loans')])),
+                ('date', models.DateField()),
+                ('module', models.CharField(max_length=20)),
+                ('activity', models.CharField(max_length=200, blank=True)),
+                ('partner', models.CharField(max_length=200, blank=True)),
+                ('gender', models.CharField(max_length=32, blank=True)),
+                ('birth_decade', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('date',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailystat',
+            unique_together=set([('kind', 'date', 'module', 'activity', 'partner', 'gender', 'birth_decade')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='dailystat',
+            index_together=set([('kind', 'date')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Partial indexes: only the open loans are indexed, so they stay small
+# whatever the number of returned loans.
+INDEXES = [
+    ('monitoring_loan_open_due_date', 'due_date'),
+    ('monitoring_loan_open_specimen', 'specimen_id'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0002_dailystat'),
+    ]
+
+    operations = [
+        # Lists of statements, so that sqlparse is not needed to split them.
+        migrations.RunSQL(
+            ['CREATE INDEX {} ON monitoring_loan ({}) '
+             'WHERE returned_at IS NULL'.format(name, column)],
+            ['DROP INDEX {}'.format(name)])
+        for name, column in INDEXES
+    ]
@@ -1,11 +1,17 @@
+from collections import Counter
 from datetime import date, datetime
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from ideascube.models import TimeStampedModel
+from ideascube.utils import batches
 
 
 class Entry(TimeStampedModel):
@@ -49,6 +55,44 @@ class Inventory(TimeStampedModel):
     def __contains__(self, specimen):
         return self.inventoryspecimen_set.filter(specimen=specimen).exists()
 
+    def specimens_by_id(self):
+        """The InventorySpecimen of this inventory, by specimen id."""
+        return {s.specimen_id: s for s in self.inventoryspecimen_set.all()}
+
+    def record_scans(self, barcodes):
+        """Count the `barcodes` scans; return their rows and the unknown."""
+        scans = Counter(barcodes)
+        specimens = []
+        for batch in batches(sorted(scans)):
+            specimens.extend(Specimen.objects.filter(barcode__in=batch))
+        unknown = sorted(set(scans) - set(s.barcode for s in specimens))
+        ids = [s.pk for s in specimens]
+        with transaction.atomic():
+            found = set()
+            for batch in batches(ids):
+                found.update(self.inventoryspecimen_set.filter(
+                    specimen__in=batch).values_list('specimen_id', flat=True))
+            InventorySpecimen.objects.bulk_create([
+                InventorySpecimen(inventory=self, specimen=s,
+                                  count=scans[s.barcode])
+                for s in specimens if s.pk not in found])
+            # One update per number of scans, usually 1.
+            by_count = {}
+            for specimen in specimens:
+                if specimen.pk in found:
+                    by_count.setdefault(scans[specimen.barcode], []).append(
+                        specimen.pk)
+            for count, pks in sorted(by_count.items()):
+                for batch in batches(pks):
+                    self.inventoryspecimen_set.filter(
+                        specimen__in=batch).update(count=F('count') + count)
+            scanned = []
+            for batch in batches(ids):
+                scanned.extend(self.inventoryspecimen_set.filter(
+                    specimen__in=batch).select_related('specimen__item'))
+        scanned.sort(key=lambda s: s.specimen.barcode)
+        return scanned, unknown
+
 
 class StockItem(models.Model):
     CINEMA = 'cinema'
@@ -108,8 +152,18 @@ class InventorySpecimen(models.Model):
 class LoanQuerySet(models.QuerySet):
 
     def due(self):
+        # Uses the partial indexes on open loans, see migration 0003.
         return self.filter(returned_at__isnull=True)
 
+    def overdue(self):
+        return self.due().filter(due_date__lt=date.today())
+
+    def open_by_barcode(self, barcode):
+        """The open loan of the specimen with this `barcode`, or None."""
+        return (self.due().filter(specimen__barcode=barcode)
+                          .select_related('specimen__item')
+                          .order_by('created_at').first())
+
     def returned(self):
         return self.filter(returned_at__isnull=False)
 
@@ -129,9 +183,129 @@ class Loan(TimeStampedModel):
     def due(self):
         return self.returned_at is None
 
+    @property
+    def overdue(self):
+        return self.due and self.due_date < date.today()
+
     def mark_returned(self):
         self.returned_at = datetime.now()
         self.save()
 
     class Meta:
         ordering = ('due_date', 'created_at')
+
+
+class DailyStatQuerySet(models.QuerySet):
+
+    def add(self, kind, keys):
+        """Count the entries or loans of `kind` described by `keys`."""
+        with transaction.atomic():
+            for key, count in Counter(keys).items():
+                fields = dict(zip(DailyStat.KEY_FIELDS, key), kind=kind)
+                if self.filter(**fields).update(count=F('count') + count):
+                    continue
+                try:
+                    with transaction.atomic():
+                        self.create(count=count, **fields)
+                except IntegrityError:
+                    # Created by a concurrent request in the meantime.
+                    self.filter(**fields).update(count=F('count') + count)
+
+    def add_entries(self, entries):
+        self.add(DailyStat.ENTRY, (DailyStat.entry_key(e) for e in entries))
+
+    def add_loans(self, loans):
+        self.add(DailyStat.LOAN, (DailyStat.loan_key(l) for l in loans))
+
+    def rebuild(self):
+        """Recompute all the statistics; return the number of rows."""
+        entries = Entry.objects.values_list(
+            'created_at', 'module', 'activity', 'partner', 'user__gender',
+            'user__birth_year')
+        loans = Loan.objects.values_list(
+            'created_at', 'specimen__item__module', 'user__gender',
+            'user__birth_year')
+        counts = Counter()
+        for created_at, module, activity, partner, gender, year in \
+                entries.iterator():
+            counts[DailyStat.ENTRY, DailyStat.make_key(
+                created_at, module, activity, partner, gender, year)] += 1
+        for created_at, module, gender, year in loans.iterator():
+            counts[DailyStat.LOAN, DailyStat.make_key(
+                created_at, module, '', '', gender, year)] += 1
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                DailyStat(kind=kind, count=count,
+                          **dict(zip(DailyStat.KEY_FIELDS, key)))
+                for (kind, key), count in counts.items()])
+        return len(counts)
+
+    def totals(self, *fields):
+        """Sum the counts, grouped by `fields`."""
+        return (self.values(*fields).annotate(total=Sum('count'))
+                                    .order_by(*fields))
+
+
+class DailyStat(models.Model):
+    """Number of entries or loans per day and per KEY_FIELDS values."""
+    ENTRY = 'entry'
+    LOAN = 'loan'
+    KINDS = (
+        (ENTRY, _('Entries')),
+        (LOAN, _('Loans')),
+    )
+    KEY_FIELDS = ('date', 'module', 'activity', 'partner', 'gender',
+                  'birth_decade')
+    BIRTH_YEAR_BUCKET = 10
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    date = models.DateField()
+    module = models.CharField(max_length=20)
+    activity = models.CharField(max_length=200, blank=True)
+    partner = models.CharField(max_length=200, blank=True)
+    gender = models.CharField(max_length=32, blank=True)
+    # First year of the bucket, 0 when the birth year is unknown.
+    birth_decade = models.PositiveSmallIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = DailyStatQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('kind', 'date', 'module', 'activity', 'partner',
+                           'gender', 'birth_decade')
+        index_together = [('kind', 'date')]
+        ordering = ('date',)
+
+    @classmethod
+    def make_key(cls, created_at, module, activity, partner, gender,
+                 birth_year):
+        if timezone.is_aware(created_at):
+            created_at = timezone.localtime(created_at)
+        if birth_year:
+            birth_year -= birth_year % cls.BIRTH_YEAR_BUCKET
+        return (created_at.date(), module, activity, partner, gender or '',
+                birth_year or 0)
+
+    @classmethod
+    def entry_key(cls, entry):
+        return cls.make_key(entry.created_at, entry.module, entry.activity,
+                            entry.partner, entry.user.gender,
+                            entry.user.birth_year)
+
+    @classmethod
+    def loan_key(cls, loan):
+        return cls.make_key(loan.created_at, loan.specimen.item.module, '',
+                            '', loan.user.gender, loan.user.birth_year)
+
+
+@receiver(post_save, sender=Entry)
+def add_entry_stat(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        DailyStat.objects.add_entries([instance])
+
+
+@receiver(post_save, sender=Loan)
+def add_loan_stat(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        DailyStat.objects.add_loans([instance])
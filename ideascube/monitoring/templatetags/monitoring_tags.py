@@ -12,3 +12,9 @@ def get_inventory_specimen(inventory, specimen):
                                              specimen=specimen)
     except InventorySpecimen.DoesNotExist:
         return None
+
+
+@register.filter()
+def inventory_specimen(specimens_by_id, specimen):
+    """Look `specimen` up in the result of Inventory.specimens_by_id()."""
+    return specimens_by_id.get(specimen.pk)
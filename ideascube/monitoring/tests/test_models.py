@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from ideascube.tests.factories import UserFactory
+
+from ..models import DailyStat, Entry
+from .factories import EntryFactory, LoanFactory, SpecimenFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def totals(*fields, **filters):
+    return list(DailyStat.objects.filter(**filters).totals(*fields))
+
+
+def test_entry_creation_updates_daily_stats():
+    user = UserFactory(gender='female', birth_year=1987)
+    EntryFactory.create_batch(2, user=user, activity='chess')
+    EntryFactory(user=user, module='library')
+    assert totals('module', 'activity', 'gender', 'birth_decade',
+                  kind=DailyStat.ENTRY) == [
+        {'module': 'cinema', 'activity': 'chess', 'gender': 'female',
+         'birth_decade': 1980, 'total': 2},
+        {'module': 'library', 'activity': '', 'gender': 'female',
+         'birth_decade': 1980, 'total': 1},
+    ]
+    assert DailyStat.objects.count() == 2
+
+
+def test_loan_creation_updates_daily_stats():
+    specimen = SpecimenFactory(item__module='library')
+    LoanFactory(specimen=specimen, user__birth_year=None)
+    assert totals('module', 'birth_decade', kind=DailyStat.LOAN) == [
+        {'module': 'library', 'birth_decade': 0, 'total': 1},
+    ]
+    assert not DailyStat.objects.filter(kind=DailyStat.ENTRY).exists()
+
+
+def test_add_entries_counts_each_key_once():
+    user = UserFactory()
+    entries = [Entry(user=user, module='cinema',
+                     created_at=timezone.now()) for _ in range(3)]
+    DailyStat.objects.add_entries(entries)
+    DailyStat.objects.add_entries(entries[:1])
+    assert DailyStat.objects.get().count == 4
+
+
+def test_stats_are_grouped_by_local_day(settings):
+    settings.TIME_ZONE = 'Asia/Amman'
+    user = UserFactory()
+    late = timezone.make_aware(datetime(2016, 1, 1, 23, 0), timezone.utc)
+    entry = Entry(user=user, module='cinema', created_at=late)
+    assert DailyStat.entry_key(entry)[0] == datetime(2016, 1, 2).date()
+
+
+def test_rebuild_stats_command():
+    EntryFactory.create_batch(3, activity='chess')
+    LoanFactory()
+    expected = sorted(DailyStat.objects.values_list(
+        'kind', 'date', 'module', 'activity', 'gender', 'count'))
+    DailyStat.objects.all().delete()
+    EntryFactory()
+    Entry.objects.filter(activity='').delete()
+    call_command('rebuild_stats')
+    assert sorted(DailyStat.objects.values_list(
+        'kind', 'date', 'module', 'activity', 'gender', 'count')) == expected
@@ -3,12 +3,15 @@ from datetime import date, timedelta
 
 import pytest
 from django.core.urlresolvers import reverse
-from django.utils import translation
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
 
 from ideascube.tests.factories import UserFactory
 
-from ..models import (Entry, Inventory, InventorySpecimen, Loan, Specimen,
-                      StockItem)
+from ..forms import ReturnForm
+from ..models import (DailyStat, Entry, Inventory, InventorySpecimen, Loan,
+                      Specimen, StockItem)
 from .factories import (EntryFactory, InventoryFactory, LoanFactory,
                         SpecimenFactory, StockItemFactory)
 
@@ -46,6 +49,33 @@ def test_cannot_create_entries_with_duplicate_serials(staffapp):
     assert Entry.objects.count() == 1
 
 
+def test_create_entries_reports_unknown_serials_at_once(staffapp):
+    UserFactory(serial='123456')
+    form = staffapp.get(reverse('monitoring:entry')).forms['entry_form']
+    form['serials'] = '123456\nunknown2\nunknown1'
+    resp = form.submit('entry_cinema').follow()
+    assert Entry.objects.count() == 1
+    resp.mustcontain('No user found with serials unknown1, unknown2',
+                     'Created 1 entries')
+
+
+def test_create_entries_query_count_does_not_depend_on_serials(staffapp):
+    users = UserFactory.create_batch(20)
+
+    def submit(serials):
+        form = staffapp.get(reverse('monitoring:entry')).forms['entry_form']
+        form['serials'] = '\n'.join(serials)
+        with CaptureQueriesContext(connection) as context:
+            form.submit('entry_cinema')
+        return len(context)
+
+    # The first entry of the day creates its statistics row.
+    submit([users[0].serial])
+    expected = submit([users[1].serial, 'unknown'])
+    assert submit([u.serial for u in users[2:]] + ['unknown']) == expected
+    assert Entry.objects.count() == 20
+
+
 def test_can_create_entries_with_activity(staffapp):
     UserFactory(serial='123456')
     form = staffapp.get(reverse('monitoring:entry')).forms['entry_form']
@@ -76,6 +106,104 @@ def test_export_entry_should_return_csv_with_entries(staffapp, settings):
     assert content.count("cinema") == 3
 
 
+def test_export_entry_should_contain_user_fields(staffapp, settings):
+    user = UserFactory(serial='123456', birth_year=1980, refugee_id='R12')
+    EntryFactory(user=user)
+    settings.MONITORING_ENTRY_EXPORT_FIELDS = ['serial', 'refugee_id',
+                                               'birth_year', 'user_id']
+    resp = staffapp.get(reverse('monitoring:export_entry'), status=200)
+    lines = resp.content.decode().splitlines()
+    assert lines[0] == ('module,date,activity,partner,serial,refugee_id,'
+                        'birth_year,user_id')
+    assert lines[1].endswith(',123456,R12,1980,')
+
+
+def test_export_entry_should_contain_user_attributes(staffapp, settings):
+    user = UserFactory(serial='123456')
+    EntryFactory(user=user)
+    settings.MONITORING_ENTRY_EXPORT_FIELDS = ['serial', 'pk']
+    url = reverse('monitoring:export_entry')
+    lines = staffapp.get(url, status=200).content.decode().splitlines()
+    assert lines[0].endswith(',serial,pk')
+    assert lines[1].endswith(',123456,{}'.format(user.pk))
+    expected = count_queries(staffapp, url)
+    EntryFactory.create_batch(5)
+    assert count_queries(staffapp, url) == expected
+
+
+def count_queries(app, url):
+    with CaptureQueriesContext(connection) as context:
+        app.get(url, status=200)
+    return len(context)
+
+
+def test_export_entry_query_count_does_not_depend_on_rows(staffapp,
+                                                          settings):
+    settings.MONITORING_ENTRY_EXPORT_FIELDS = ['serial', 'birth_year']
+    url = reverse('monitoring:export_entry')
+    EntryFactory()
+    expected = count_queries(staffapp, url)
+    EntryFactory.create_batch(10)
+    assert count_queries(staffapp, url) == expected
+
+
+def test_create_entries_updates_daily_stats(staffapp):
+    UserFactory(serial='123456')
+    UserFactory(serial='654321')
+    form = staffapp.get(reverse('monitoring:entry')).forms['entry_form']
+    form['serials'] = '123456\n654321'
+    form.submit('entry_library').follow()
+    stat = DailyStat.objects.get()
+    assert stat.module == 'library'
+    assert stat.count == 2
+
+
+def test_non_staff_should_not_access_stats_page(loggedapp):
+    assert loggedapp.get(reverse('monitoring:stats'), status=302)
+    assert loggedapp.get(reverse('monitoring:stats_json'), status=302)
+
+
+def test_stats_page_shows_totals(staffapp):
+    EntryFactory.create_batch(2, module='library')
+    EntryFactory(module='cinema')
+    resp = staffapp.get(reverse('monitoring:stats'),
+                        {'group_by': 'module'}, status=200)
+    cells = [td.text for td in resp.pyquery('table.stats td')]
+    assert cells == ['cinema', '1', 'library', '2']
+
+
+def test_stats_json_reads_only_the_rollups(staffapp):
+    EntryFactory.create_batch(2, activity='chess')
+    LoanFactory()
+    with CaptureQueriesContext(connection) as context:
+        resp = staffapp.get(reverse('monitoring:stats_json'),
+                            {'group_by': ['activity'], 'kind': 'entry'},
+                            status=200)
+    assert resp.json == {'kind': 'entry', 'group_by': ['activity'],
+                         'results': [{'activity': 'chess', 'total': 2}]}
+    tables = ' '.join(q['sql'] for q in context.captured_queries)
+    assert 'monitoring_dailystat' in tables
+    assert 'monitoring_entry' not in tables
+    assert 'monitoring_loan' not in tables
+
+
+def test_stats_json_filters_by_dates(staffapp):
+    EntryFactory()
+    DailyStat.objects.update(date=date(2015, 6, 1))
+    url = reverse('monitoring:stats_json')
+    resp = staffapp.get(url, {'since': '2015-06-02'}, status=200)
+    assert resp.json['results'] == []
+    resp = staffapp.get(url, {'until': '2015-06-01'}, status=200)
+    assert resp.json['results'] == [
+        {'date': '2015-06-01', 'module': 'cinema', 'total': 1}]
+
+
+def test_stats_json_with_invalid_group_by(staffapp):
+    resp = staffapp.get(reverse('monitoring:stats_json'),
+                        {'group_by': 'user'}, status=400)
+    assert 'group_by' in resp.json['errors']
+
+
 def test_anonymous_should_not_access_stock_page(app):
     assert app.get(reverse('monitoring:stock'), status=302)
 
@@ -88,6 +216,44 @@ def test_staff_should_access_stock_page(staffapp):
     assert staffapp.get(reverse('monitoring:stock'), status=200)
 
 
+def test_stock_page_query_count_does_not_depend_on_rows(staffapp):
+    url = reverse('monitoring:stock')
+    SpecimenFactory()
+    expected = count_queries(staffapp, url)
+    for module, name in StockItem.MODULES:
+        SpecimenFactory.create_batch(2, item__module=module)
+    SpecimenFactory.create_batch(3, item=StockItem.objects.first())
+    assert count_queries(staffapp, url) == expected
+
+
+def test_stock_page_shows_specimens_count(staffapp):
+    item = StockItemFactory()
+    SpecimenFactory.create_batch(3, item=item)
+    resp = staffapp.get(reverse('monitoring:stock'), status=200)
+    resp.mustcontain('Total: 3')
+
+
+def test_non_staff_should_not_access_stock_module_page(loggedapp):
+    url = reverse('monitoring:stock_module', kwargs={'module': 'cinema'})
+    assert loggedapp.get(url, status=302)
+
+
+def test_stock_module_page_is_paginated(staffapp):
+    StockItemFactory.create_batch(51, module='library')
+    StockItemFactory(module='cinema', name='not in library')
+    url = reverse('monitoring:stock_module', kwargs={'module': 'library'})
+    resp = staffapp.get(url, status=200)
+    assert len(resp.pyquery('tr.stockitem')) == 50
+    resp.mustcontain('Page 1 of 2', no=['not in library'])
+    resp = staffapp.get(url, {'page': 2}, status=200)
+    assert len(resp.pyquery('tr.stockitem')) == 1
+
+
+def test_stock_module_page_with_unknown_module_is_404(staffapp):
+    url = reverse('monitoring:stock_module', kwargs={'module': 'unknown'})
+    assert staffapp.get(url, status=404)
+
+
 def test_anonymous_should_not_access_stockitem_create_page(app):
     assert app.get(reverse('monitoring:stockitem_create'), status=302)
 
@@ -225,6 +391,153 @@ def test_export_inventory_should_be_ok_in_arabic(staffapp, settings):
     translation.deactivate()
 
 
+def test_export_inventory_status(staffapp):
+    inventory = InventoryFactory()
+    found = SpecimenFactory(barcode='123', count=3)
+    SpecimenFactory(barcode='456')
+    InventorySpecimen.objects.create(inventory=inventory, specimen=found,
+                                     count=2)
+    url = reverse('monitoring:inventory_export', kwargs={'pk': inventory.pk})
+    lines = staffapp.get(url, status=200).content.decode().splitlines()
+    statuses = dict((line.split(',')[3], line.split(',')[-1])
+                    for line in lines[1:])
+    assert statuses == {'123': '3', '456': 'ko'}
+
+
+def test_export_inventory_query_count_does_not_depend_on_rows(staffapp):
+    inventory = InventoryFactory()
+    url = reverse('monitoring:inventory_export', kwargs={'pk': inventory.pk})
+    specimen = SpecimenFactory()
+    InventorySpecimen.objects.create(inventory=inventory, specimen=specimen)
+    expected = count_queries(staffapp, url)
+    for specimen in SpecimenFactory.create_batch(10):
+        InventorySpecimen.objects.create(inventory=inventory,
+                                         specimen=specimen)
+    SpecimenFactory.create_batch(5)
+    assert count_queries(staffapp, url) == expected
+
+
+def test_inventory_page_query_count_does_not_depend_on_rows(staffapp):
+    inventory = InventoryFactory()
+    url = reverse('monitoring:inventory', kwargs={'pk': inventory.pk})
+    specimen = SpecimenFactory()
+    InventorySpecimen.objects.create(inventory=inventory, specimen=specimen)
+    expected = count_queries(staffapp, url)
+    for specimen in SpecimenFactory.create_batch(10):
+        InventorySpecimen.objects.create(inventory=inventory,
+                                         specimen=specimen)
+    SpecimenFactory.create_batch(5)
+    assert count_queries(staffapp, url) == expected
+
+
+def test_inventory_page_shows_specimen_status(staffapp):
+    inventory = InventoryFactory()
+    found = SpecimenFactory(count=2)
+    SpecimenFactory()
+    InventorySpecimen.objects.create(inventory=inventory, specimen=found,
+                                     count=1)
+    url = reverse('monitoring:inventory', kwargs={'pk': inventory.pk})
+    resp = staffapp.get(url, status=200)
+    assert len(resp.pyquery('td.missing')) == 1
+    assert len(resp.pyquery('td.notfound')) == 1
+
+
+def test_non_staff_cannot_scan_inventory_specimens(loggedapp):
+    inventory = InventoryFactory()
+    url = reverse('monitoring:inventoryspecimen_scan',
+                  kwargs={'pk': inventory.pk})
+    loggedapp.get(url, status=302)
+
+
+def scan(app, inventory, barcodes, status=200):
+    url = reverse('monitoring:inventory', kwargs={'pk': inventory.pk})
+    token = app.get(url).forms['by_barcode']['csrfmiddlewaretoken'].value
+    url = reverse('monitoring:inventoryspecimen_scan',
+                  kwargs={'pk': inventory.pk})
+    return app.post(url, {'barcode': barcodes, 'csrfmiddlewaretoken': token},
+                    status=status)
+
+
+def test_scan_records_inventory_specimen(staffapp):
+    inventory = InventoryFactory()
+    specimen = SpecimenFactory(barcode='123', count=2)
+    resp = scan(staffapp, inventory, '123')
+    assert InventorySpecimen.objects.get(inventory=inventory,
+                                         specimen=specimen).count == 1
+    row, = resp.json['rows']
+    assert row['specimen'] == specimen.pk
+    assert row['count'] == 1
+    assert 'id="specimen-{}"'.format(specimen.pk) in row['html']
+    assert 'class="missing"' in row['html']
+    assert resp.json['unknown'] == []
+    resp = scan(staffapp, inventory, '123')
+    assert resp.json['rows'][0]['count'] == 2
+    assert 'class="found"' in resp.json['rows'][0]['html']
+
+
+def test_scan_batch_of_barcodes(staffapp):
+    inventory = InventoryFactory()
+    found = SpecimenFactory(barcode='123')
+    InventorySpecimen.objects.create(inventory=inventory, specimen=found)
+    SpecimenFactory(barcode='456')
+    resp = scan(staffapp, inventory, ['123', '456\n456 unknown'])
+    assert sorted((r['barcode'], r['count']) for r in resp.json['rows']) == [
+        ('123', 2), ('456', 2)]
+    assert resp.json['unknown'] == ['unknown']
+    assert 'unknown' in resp.json['error']
+    assert dict(InventorySpecimen.objects.values_list(
+        'specimen__barcode', 'count')) == {'123': 2, '456': 2}
+
+
+def test_scan_query_count_does_not_depend_on_batch_size():
+    inventory = InventoryFactory()
+    specimens = SpecimenFactory.create_batch(20)
+
+    def count(specimens):
+        with CaptureQueriesContext(connection) as context:
+            inventory.record_scans([s.barcode for s in specimens])
+        return len(context)
+
+    assert count(specimens[:1]) == count(specimens[1:])
+
+
+def test_scan_updates_the_found_specimens_by_scan_count():
+    inventory = InventoryFactory()
+    specimens = SpecimenFactory.create_batch(20)
+    for specimen in specimens:
+        InventorySpecimen.objects.create(inventory=inventory,
+                                         specimen=specimen)
+    barcodes = [s.barcode for s in specimens] + [specimens[0].barcode]
+    with CaptureQueriesContext(connection) as context:
+        inventory.record_scans(barcodes)
+    updates = [q['sql'] for q in context.captured_queries
+               if 'UPDATE "monitoring_inventoryspecimen"' in q['sql']]
+    # Scanned once, and twice.
+    assert len(updates) == 2
+    counts = InventorySpecimen.objects.values_list('count', flat=True)
+    assert sorted(counts) == [2] * 19 + [3]
+
+
+def test_scan_only_reads_the_scanned_specimens():
+    inventory = InventoryFactory()
+    for specimen in SpecimenFactory.create_batch(5):
+        InventorySpecimen.objects.create(inventory=inventory,
+                                         specimen=specimen)
+    SpecimenFactory(barcode='123')
+    with CaptureQueriesContext(connection) as context:
+        scanned, unknown = inventory.record_scans(['123', '123'])
+    assert [(s.specimen.barcode, s.count) for s in scanned] == [('123', 2)]
+    reads = [q['sql'] for q in context.captured_queries
+             if q['sql'].startswith('QUERY = \'SELECT') and
+             'monitoring_inventoryspecimen' in q['sql']]
+    assert len(reads) == 2
+    assert all('"specimen_id" IN' in sql for sql in reads)
+
+
+def test_scan_without_barcode(staffapp):
+    scan(staffapp, InventoryFactory(), ' ', status=400)
+
+
 def test_staff_can_create_inventoryspeciment_by_barcode(staffapp):
     inventory = InventoryFactory()
     specimen = SpecimenFactory()
@@ -318,6 +631,37 @@ def test_can_decrease_inventoryspeciment_by_click_on_decrease_link(staffapp):
                                          specimen=specimen).count == 1
 
 
+def test_cannot_decrease_inventoryspecimen_below_zero(staffapp):
+    m2m = InventorySpecimen.objects.create(inventory=InventoryFactory(),
+                                           specimen=SpecimenFactory(),
+                                           count=0)
+    staffapp.get(reverse('monitoring:inventoryspecimen_decrease',
+                         kwargs={'pk': m2m.pk}), status=302)
+    assert InventorySpecimen.objects.get(pk=m2m.pk).count == 0
+
+
+def test_increase_inventoryspecimen_is_a_single_update(staffapp):
+    m2m = InventorySpecimen.objects.create(inventory=InventoryFactory(),
+                                           specimen=SpecimenFactory(),
+                                           count=2)
+    url = reverse('monitoring:inventoryspecimen_increase',
+                  kwargs={'pk': m2m.pk})
+    with CaptureQueriesContext(connection) as context:
+        staffapp.get(url, status=302)
+    assert InventorySpecimen.objects.get(pk=m2m.pk).count == 3
+    updates = [q['sql'] for q in context.captured_queries
+               if 'UPDATE "monitoring_inventoryspecimen"' in q['sql']]
+    assert len(updates) == 1
+    # Computed by the database, so that concurrent changes are not lost.
+    assert '"count" = ("monitoring_inventoryspecimen"."count" + ' in \
+        updates[0]
+
+
+def test_adjust_unknown_inventoryspecimen_is_404(staffapp):
+    staffapp.get(reverse('monitoring:inventoryspecimen_increase',
+                         kwargs={'pk': 123}), status=404)
+
+
 def test_can_loan(staffapp, user):
     assert not Loan.objects.count()
     specimen = SpecimenFactory()
@@ -396,6 +740,62 @@ def test_return_unknown_id_does_not_fail(staffapp):
     form.submit('do_return', status=200)
 
 
+def test_loan_page_query_count_does_not_depend_on_rows(staffapp):
+    url = reverse('monitoring:loan')
+    LoanFactory()
+    expected = count_queries(staffapp, url)
+    LoanFactory.create_batch(10)
+    assert count_queries(staffapp, url) == expected
+
+
+def test_loan_page_is_paginated(staffapp):
+    LoanFactory.create_batch(51)
+    resp = staffapp.get(reverse('monitoring:loan'), status=200)
+    resp.mustcontain('Page 1 of 2')
+    resp = staffapp.get(reverse('monitoring:loan'), {'page': 2}, status=200)
+    resp.mustcontain('Page 2 of 2')
+    staffapp.get(reverse('monitoring:loan'), {'page': 3}, status=404)
+    staffapp.get(reverse('monitoring:loan'), {'page': 'x'}, status=404)
+
+
+def test_loan_page_can_show_only_overdue_loans(staffapp):
+    LoanFactory(specimen__item__name='late item',
+                due_date=date.today() - timedelta(days=1))
+    LoanFactory(specimen__item__name='on time item')
+    LoanFactory(specimen__item__name='returned item',
+                due_date=date.today() - timedelta(days=1),
+                returned_at=timezone.now())
+    resp = staffapp.get(reverse('monitoring:loan'), status=200)
+    resp.mustcontain('late item', 'on time item', no=['returned item'])
+    resp = staffapp.get(reverse('monitoring:loan'), {'overdue': 1},
+                        status=200)
+    resp.mustcontain('late item', no=['on time item', 'returned item'])
+
+
+def test_return_form_finds_open_loan_in_one_query():
+    specimen = SpecimenFactory(barcode='123')
+    LoanFactory(specimen=specimen, returned_at=timezone.now())
+    loan = LoanFactory(specimen=specimen)
+    form = ReturnForm(data={'loan': '123'})
+    with CaptureQueriesContext(connection) as context:
+        assert form.is_valid()
+        assert form.cleaned_data['loan'] == loan
+        assert str(form.cleaned_data['loan'].specimen.item)
+    assert len(context) == 1
+
+
+def test_open_loans_lookups_use_partial_indexes():
+    plans = []
+    for qs in (Loan.objects.overdue(),
+               Loan.objects.due().filter(specimen__barcode='123')):
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plans.append(' '.join(str(row) for row in cursor.fetchall()))
+    assert 'monitoring_loan_open_due_date' in plans[0]
+    assert 'monitoring_loan_open_specimen' in plans[1]
+
+
 def test_can_export_loan(staffapp):
     specimen = SpecimenFactory(item__name="an item", barcode="123")
     LoanFactory(specimen=specimen)
@@ -404,6 +804,14 @@ def test_can_export_loan(staffapp):
     assert resp.content.decode().startswith("item,barcode,user,loaned at,due date,returned at,comments\r\nan item,123")  # noqa
 
 
+def test_export_loan_query_count_does_not_depend_on_rows(staffapp):
+    url = reverse('monitoring:export_loan')
+    LoanFactory()
+    expected = count_queries(staffapp, url)
+    LoanFactory.create_batch(10)
+    assert count_queries(staffapp, url) == expected
+
+
 def test_export_loan_should_be_ok_in_arabic(staffapp):
     translation.activate('ar')
     specimen = SpecimenFactory(item__name="an item", barcode="123")
@@ -5,10 +5,14 @@ from . import views
 urlpatterns = [
     url(r'^entry/$', views.entry, name='entry'),
     url(r'^entry/export/$', views.export_entry, name='export_entry'),
+    url(r'^stats/$', views.stats, name='stats'),
+    url(r'^stats/json/$', views.stats_json, name='stats_json'),
     url(r'^stock/$', views.stock, name='stock'),
+    url(r'^stock/module/(?P<module>[\w]+)/$', views.stock_module, name='stock_module'),  # noqa
     url(r'^stock/inventory/(?P<pk>[\d]+)/$', views.inventory, name='inventory'),  # noqa
     url(r'^stock/inventory/(?P<pk>[\d]+)/edit/$', views.inventory_update, name='inventory_update'),  # noqa
     url(r'^stock/inventory/(?P<pk>[\d]+)/export/$', views.inventory_export, name='inventory_export'),  # noqa
+    url(r'^stock/inventory/(?P<pk>[\d]+)/scan/$', views.inventoryspecimen_scan, name='inventoryspecimen_scan'),  # noqa
     url(r'^inventory/(?P<pk>[\d]+)/delete/$', views.inventory_delete, name='inventory_delete'),  # noqa
     url(r'^stock/inventory/new/$', views.inventory_create, name='inventory_create'),  # noqa
     url(r'^stock/item/(?P<pk>[\d]+)/edit/$', views.stockitem_update, name='stockitem_update'),  # noqa
@@ -1,22 +1,29 @@
+from collections import defaultdict
 from datetime import date, timedelta
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse_lazy
-from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.db.models import Count, F
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.utils.translation import ugettext as _
 from django.views.generic import (CreateView, DeleteView, DetailView, FormView,
-                                  TemplateView, UpdateView, View)
+                                  ListView, TemplateView, UpdateView, View)
+from django.views.generic.list import MultipleObjectMixin
 
 from ideascube.views import CSVExportMixin
 from ideascube.decorators import staff_member_required
+from ideascube.utils import batches
 
 from .forms import (EntryForm, ExportEntryForm, ExportLoanForm,
-                    InventorySpecimenForm, LoanForm, ReturnForm, SpecimenForm)
-from .models import (Entry, Inventory, InventorySpecimen, Loan, Specimen,
-                     StockItem)
+                    InventorySpecimenForm, LoanForm, ReturnForm, SpecimenForm,
+                    StatsForm)
+from .models import (DailyStat, Entry, Inventory, InventorySpecimen, Loan,
+                     Specimen, StockItem)
 
 user_model = get_user_model()
 
@@ -27,25 +34,36 @@ class EntryView(FormView):
     form_class = EntryForm
     success_url = reverse_lazy('monitoring:entry')
 
+    def get_users(self, serials):
+        """Return the users with these serials, by serial."""
+        users = {}
+        for batch in batches(sorted(serials)):
+            for user in user_model.objects.filter(serial__in=batch):
+                users[user.serial] = user
+        return users
+
     def form_valid(self, form):
-        count = 0
         module = form.cleaned_data['module']
         activity = form.cleaned_data['activity']
         partner = form.cleaned_data['partner']
         activity_select = form.cleaned_data['activity_list']
         if not activity and activity_select:
             activity = activity_select
-        for serial in form.cleaned_data['serials']:
-            try:
-                user = user_model.objects.get(serial=serial)
-            except user_model.DoesNotExist:
-                msg = _('No user found with serial {serial}')
-                msg = msg.format(serial=serial)
-                messages.add_message(self.request, messages.ERROR, msg)
-            else:
-                Entry.objects.create(user=user, module=module,
-                                     activity=activity, partner=partner)
-                count += 1
+        serials = form.cleaned_data['serials']
+        users = self.get_users(serials)
+        unknown = sorted(set(serials) - set(users))
+        if unknown:
+            msg = _('No user found with serials {serials}')
+            msg = msg.format(serials=', '.join(unknown))
+            messages.add_message(self.request, messages.ERROR, msg)
+        entries = [Entry(user=user, module=module, activity=activity,
+                         partner=partner)
+                   for serial, user in sorted(users.items())]
+        with transaction.atomic():
+            # bulk_create does not send post_save, count them here.
+            Entry.objects.bulk_create(entries)
+            DailyStat.objects.add_entries(entries)
+        count = len(users)
         if count:
             msg = _('Created {count} entries')
             msg = msg.format(count=count)
@@ -83,31 +101,93 @@ class ExportEntry(CSVExportMixin, View):
         self.fields.extend(settings.MONITORING_ENTRY_EXPORT_FIELDS)
         return self.fields
 
+    def get_user_fields(self):
+        """Export fields that are user model columns."""
+        names = set(f.name for f in user_model._meta.concrete_fields)
+        return [f for f in settings.MONITORING_ENTRY_EXPORT_FIELDS
+                if f in names]
+
     def get_items(self):
         qs = Entry.objects.order_by('created_at')
         if self.form.cleaned_data['since']:
             qs = qs.filter(created_at__gte=self.form.cleaned_data['since'])
-        return qs
+        # One query for all the rows, users included.
+        fields = settings.MONITORING_ENTRY_EXPORT_FIELDS
+        if self.get_user_fields() != list(fields):
+            # Other attributes of the users, eg. properties.
+            return (self.get_values(entry)
+                    for entry in qs.select_related('user'))
+        user_fields = ['user__' + f for f in fields]
+        return qs.values('module', 'created_at', 'activity', 'partner',
+                         *user_fields)
+
+    def get_values(self, entry):
+        values = {'module': entry.module, 'created_at': entry.created_at,
+                  'activity': entry.activity, 'partner': entry.partner}
+        for field in settings.MONITORING_ENTRY_EXPORT_FIELDS:
+            values['user__' + field] = getattr(entry.user, field, None)
+        return values
 
     def get_row(self, entry):
-        row = {'module': entry.module, 'date': entry.created_at,
-               'activity': entry.activity, 'partner': entry.partner}
+        row = {'module': entry['module'], 'date': entry['created_at'],
+               'activity': entry['activity'], 'partner': entry['partner']}
         for field in settings.MONITORING_ENTRY_EXPORT_FIELDS:
-            row[field] = getattr(entry.user, field, None)
+            row[field] = entry.get('user__' + field)
         return row
 
 export_entry = staff_member_required(ExportEntry.as_view())
 
 
+class Stats(TemplateView):
+    template_name = 'monitoring/stats.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(Stats, self).get_context_data(**kwargs)
+        form = StatsForm(self.request.GET)
+        context['form'] = form
+        if form.is_valid():
+            fields = form.cleaned_data['group_by']
+            labels = dict(form.fields['group_by'].choices)
+            context['headers'] = [labels[f] for f in fields]
+            context['rows'] = [[row[f] for f in fields] + [row['total']]
+                               for row in form.totals()]
+        return context
+
+stats = staff_member_required(Stats.as_view())
+
+
+@staff_member_required
+def stats_json(request):
+    """Statistics as JSON, read from the daily rollups only."""
+    form = StatsForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    return JsonResponse({
+        'kind': form.cleaned_data['kind'],
+        'group_by': form.cleaned_data['group_by'],
+        'results': list(form.totals()),
+    })
+
+
 class StockListMixin(object):
 
+    def get_stock_items(self, **filters):
+        return (StockItem.objects.filter(**filters)
+                                 .annotate(specimens_count=Count('specimens'))
+                                 .prefetch_related('specimens'))
+
     def get_stock(self):
+        # One query for the items and one for their specimens, whatever the
+        # number of modules and items.
+        items = defaultdict(list)
+        for item in self.get_stock_items():
+            items[item.module].append(item)
         stock = []
         for key, name in StockItem.MODULES:
             stock.append({
                 'key': key,
                 'name': name,
-                'objects': StockItem.objects.filter(module=key)
+                'objects': items[key]
             })
         return stock
 
@@ -124,6 +204,25 @@ class Stock(StockListMixin, TemplateView):
 stock = staff_member_required(Stock.as_view())
 
 
+class StockModule(StockListMixin, ListView):
+    template_name = 'monitoring/stock_module.html'
+    paginate_by = 50
+
+    def get_queryset(self):
+        modules = dict(StockItem.MODULES)
+        if self.kwargs['module'] not in modules:
+            raise Http404()
+        self.module = {'key': self.kwargs['module'],
+                       'name': modules[self.kwargs['module']]}
+        return self.get_stock_items(module=self.module['key'])
+
+    def get_context_data(self, **kwargs):
+        context = super(StockModule, self).get_context_data(**kwargs)
+        context['module'] = self.module
+        return context
+stock_module = staff_member_required(StockModule.as_view())
+
+
 class InventoryDetail(StockListMixin, DetailView):
     model = Inventory
     template_name = 'monitoring/inventory.html'
@@ -131,6 +230,7 @@ class InventoryDetail(StockListMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super(InventoryDetail, self).get_context_data(**kwargs)
         context['stock'] = self.get_stock()
+        context['inventory_specimens'] = self.object.specimens_by_id()
         context['inventoryspecimen_form'] = InventorySpecimenForm(
             initial={'inventory': self.object})
         return context
@@ -161,6 +261,8 @@ class InventoryExport(CSVExportMixin, DetailView):
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
+        self.found = set(self.object.inventoryspecimen_set
+                                    .values_list('specimen_id', flat=True))
         return self.render_to_csv()
 
     def get_headers(self):
@@ -169,7 +271,7 @@ class InventoryExport(CSVExportMixin, DetailView):
         return self.headers
 
     def get_items(self):
-        return Specimen.objects.all()
+        return Specimen.objects.select_related('item')
 
     def get_row(self, specimen):
         return {
@@ -180,7 +282,7 @@ class InventoryExport(CSVExportMixin, DetailView):
             'serial': specimen.serial,
             'count': specimen.count,
             'comments': specimen.comments,
-            'status': specimen.count if specimen in self.object else 'ko'
+            'status': specimen.count if specimen.pk in self.found else 'ko'
         }
 
     def get_filename(self):
@@ -283,6 +385,40 @@ inventoryspecimen_bybarcode = staff_member_required(
     InventorySpecimenByBarCode.as_view())
 
 
+class InventorySpecimenScan(View):
+    """Record scanned bar codes in an inventory and return only the updated
+    rows, as JSON. `barcode` can be repeated, and each value can hold many
+    bar codes separated by spaces or new lines, to send a batch of scans."""
+
+    def post(self, request, *args, **kwargs):
+        inventory = get_object_or_404(Inventory, pk=self.kwargs['pk'])
+        barcodes = [barcode for value in request.POST.getlist('barcode')
+                    for barcode in value.split()]
+        if not barcodes:
+            return JsonResponse({'error': _('Missing bar code')}, status=400)
+        scanned, unknown = inventory.record_scans(barcodes)
+        rows = []
+        for inventoryspecimen in scanned:
+            specimen = inventoryspecimen.specimen
+            rows.append({
+                'specimen': specimen.pk,
+                'barcode': specimen.barcode,
+                'count': inventoryspecimen.count,
+                'html': render_to_string(
+                    'monitoring/inventory_specimen.html', {
+                        'inventory': inventory,
+                        'specimen': specimen,
+                        'inventoryspecimen': inventoryspecimen,
+                    }, request=request),
+            })
+        response = {'rows': rows, 'unknown': unknown}
+        if unknown:
+            msg = _('No specimen found with bar codes {barcodes}')
+            response['error'] = msg.format(barcodes=', '.join(unknown))
+        return JsonResponse(response)
+inventoryspecimen_scan = staff_member_required(InventorySpecimenScan.as_view())
+
+
 class InventorySpecimenRemove(View):
 
     def get(self, request, *args, **kwargs):
@@ -298,41 +434,55 @@ inventoryspecimen_remove = staff_member_required(
     InventorySpecimenRemove.as_view())
 
 
-class InventorySpecimenIncrease(View):
+class InventorySpecimenAdjust(View):
+    """Add `delta` to the count of an InventorySpecimen, in the database so
+    that concurrent scans are not lost. The count never goes below 0."""
+    delta = 0
 
     def get(self, request, *args, **kwargs):
-        obj = get_object_or_404(InventorySpecimen, pk=self.kwargs['pk'])
-        obj.count = obj.count + 1
-        obj.save()
+        inventory_pk = get_object_or_404(
+            InventorySpecimen.objects.values_list('inventory', flat=True),
+            pk=self.kwargs['pk'])
+        qs = InventorySpecimen.objects.filter(pk=self.kwargs['pk'])
+        if self.delta < 0:
+            qs = qs.filter(count__gte=-self.delta)
+        qs.update(count=F('count') + self.delta)
         url = reverse_lazy('monitoring:inventory',
-                           kwargs={'pk': obj.inventory.pk})
+                           kwargs={'pk': inventory_pk})
         return HttpResponseRedirect(url)
+
+
+class InventorySpecimenIncrease(InventorySpecimenAdjust):
+    delta = 1
 inventoryspecimen_increase = staff_member_required(
     InventorySpecimenIncrease.as_view())
 
 
-class InventorySpecimenDecrease(View):
-
-    def get(self, request, *args, **kwargs):
-        obj = get_object_or_404(InventorySpecimen, pk=self.kwargs['pk'])
-        obj.count = max(obj.count - 1, 0)
-        obj.save()
-        url = reverse_lazy('monitoring:inventory',
-                           kwargs={'pk': obj.inventory.pk})
-        return HttpResponseRedirect(url)
+class InventorySpecimenDecrease(InventorySpecimenAdjust):
+    delta = -1
 inventoryspecimen_decrease = staff_member_required(
     InventorySpecimenDecrease.as_view())
 
 
-class ItemLoan(TemplateView):
+class ItemLoan(MultipleObjectMixin, TemplateView):
     template_name = 'monitoring/loan.html'
+    context_object_name = 'loans'
+    paginate_by = 50
+
+    def get_queryset(self):
+        loans = Loan.objects.due().select_related('specimen__item', 'user',
+                                                  'by')
+        if self.request.GET.get('overdue'):
+            loans = loans.overdue()
+        return loans
 
     def get_context_data(self, **kwargs):
         due_date = date.today() + timedelta(days=settings.LOAN_DURATION)
+        self.object_list = self.get_queryset()
         defaults = {
             'loan_form': LoanForm(initial={'due_date': due_date}),
             'return_form': ReturnForm,
-            'loans': Loan.objects.due(),
+            'overdue': bool(self.request.GET.get('overdue')),
             'export_form': ExportLoanForm
         }
         defaults.update(kwargs)
@@ -397,17 +547,19 @@ class ExportLoan(CSVExportMixin, View):
         qs = Loan.objects.order_by('created_at')
         if self.form.cleaned_data['since']:
             qs = qs.filter(created_at__gte=self.form.cleaned_data['since'])
-        return qs
+        return qs.values('specimen__item__name', 'specimen__barcode',
+                         'user__serial', 'created_at', 'due_date',
+                         'returned_at', 'comments')
 
     def get_row(self, entry):
         return {
-            'item': str(entry.specimen.item),
-            'barcode': entry.specimen.barcode,
-            'user': entry.user.serial,
-            'loaned at': entry.created_at,
-            'due date': entry.due_date,
-            'returned at': entry.returned_at,
-            'comments': entry.comments
+            'item': entry['specimen__item__name'],
+            'barcode': entry['specimen__barcode'],
+            'user': entry['user__serial'],
+            'loaned at': entry['created_at'],
+            'due date': entry['due_date'],
+            'returned at': entry['returned_at'],
+            'comments': entry['comments']
         }
 
 export_loan = staff_member_required(ExportLoan.as_view())
@@ -6,7 +6,14 @@ from .utils import create_index_table
 
 def create_index(sender, **kwargs):
     if isinstance(sender, SearchConfig):
-        create_index_table(force=False)
+        if create_index_table(force=False):
+            # New or outdated table, (re)build its content.
+            from .models import SEARCHABLE, reindex
+            from .spelling import build_vocabulary
+            for model in SEARCHABLE.values():
+                for count in reindex(model):
+                    pass
+            build_vocabulary()
 
 
 class SearchConfig(AppConfig):
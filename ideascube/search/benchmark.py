@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Search benchmarks on synthetic multilingual corpora.
+
+Run them with the benchmark_search management command, which uses a
+temporary database. The report is a JSON serializable dict, so that runs
+made before and after a change (to rank(), the tokenizer, the hydration...)
+can be compared."""
+import platform
+import random
+import sqlite3
+import struct
+import time
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from ideascube.blog.models import Content
+from ideascube.library.models import Book
+from ideascube.mediacenter.models import Document
+from ideascube.models import User
+
+from .models import Search, SearchResults, reindex
+from .spelling import build_vocabulary, suggest
+from .utils import (ORIGINAL_COLUMNS, TEXT_COLUMNS, prefix_query, rank,
+                    rank_weights)
+from .views import autocomplete_results
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+MODELS = (Book, Document, Content)
+
+# A few real words of the languages of the boxes, completed with synthetic
+# ones so that the vocabulary grows with the corpus.
+WORDS = {
+    'fr': [u'école', u'élève', u'livre', u'forêt', u'musique', u'santé',
+           u'eau', u'histoire', u'enfant', u'marché'],
+    'ar': [u'كتاب', u'مدرسة', u'ماء', u'صحة', u'طفل', u'تاريخ', u'موسيقى',
+           u'سوق', u'قصة', u'علم'],
+    'sw': [u'kitabu', u'shule', u'maji', u'afya', u'mtoto', u'historia',
+           u'muziki', u'soko', u'hadithi', u'elimu'],
+    'so': [u'buug', u'dugsi', u'biyo', u'caafimaad', u'ilmo', u'taariikh',
+           u'muusig', u'suuq', u'sheeko', u'aqoon'],
+    'am': [u'መጽሐፍ', u'ትምህርት', u'ውሃ', u'ጤና', u'ልጅ', u'ታሪክ', u'ሙዚቃ',
+           u'ገበያ', u'ተረት', u'እውቀት'],
+}
+SYLLABLES = [u'ka', u'mi', u'to', u'ra', u'su', u'ne', u'lo', u'ba', u'di',
+             u'ju', u'wa', u'ye']
+QUERIES = [u'livre', u'ecole', u'كتاب', u'kitabu', u'buug', u'ትምህርት',
+           u'musique OR muziki', u'mi*']
+# Beginnings of words of the corpus, as typed in the search box.
+PREFIXES = [u'liv', u'eco', u'كت', u'kit', u'buu', u'mi']
+# Misspelled words of the corpus, to time the spelling suggestions.
+TYPOS = [u'lirve', u'musiuqe', u'kitbau', u'caafimad', u'hadithii']
+
+
+class Corpus(object):
+    """Random, but reproducible, multilingual texts."""
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.vocabulary = {}
+        for lang, words in WORDS.items():
+            extra = [u''.join(self.random.sample(SYLLABLES, 3))
+                     for _ in range(500)]
+            self.vocabulary[lang] = words * 20 + extra
+
+    def words(self, lang, count):
+        return u' '.join(self.random.choice(self.vocabulary[lang])
+                         for _ in range(count))
+
+    def lang(self):
+        return self.random.choice(sorted(WORDS))
+
+
+def generate(model, count, corpus, batch_size=500):
+    """Bulk create `count` instances of `model`, without indexing them."""
+    author = None
+    if model is Content:
+        author, _ = User.objects.get_or_create(serial='benchmark')
+    for start in range(0, count, batch_size):
+        instances = []
+        for i in range(start, min(start + batch_size, count)):
+            lang = corpus.lang()
+            if model is Book:
+                instance = Book(title=corpus.words(lang, 4), lang=lang,
+                                summary=corpus.words(lang, 40), section=1,
+                                authors=corpus.words(lang, 2))
+            elif model is Document:
+                instance = Document(title=corpus.words(lang, 4)[:100],
+                                    lang=lang, kind=Document.TEXT,
+                                    summary=corpus.words(lang, 40),
+                                    credits=corpus.words(lang, 2),
+                                    original='benchmark/{}.txt'.format(i))
+            else:
+                instance = Content(title=corpus.words(lang, 4)[:100],
+                                   lang=lang, author=author,
+                                   summary=corpus.words(lang, 10)[:300],
+                                   text=corpus.words(lang, 80),
+                                   published_at=timezone.now(),
+                                   status=Content.PUBLISHED)
+            instances.append(instance)
+        model.objects.bulk_create(instances)
+
+
+def legacy_rank(match_info):
+    """The rank() function before it was rewritten for speed, timed on the
+    same match infos."""
+    score = 0.0
+    if not match_info:
+        return score
+    bufsize = len(match_info)
+    match_info = [struct.unpack('@I', match_info[i:i+4])[0]
+                  for i in range(0, bufsize, 4)]
+    p, c = match_info[:2]
+    for phrase_num in range(p):
+        phrase_info_idx = 2 + (phrase_num * c * 3)
+        for col_num in range(c):
+            col_idx = phrase_info_idx + (col_num * 3)
+            x1, x2 = match_info[col_idx:col_idx + 2]
+            if x1 > 0:
+                score += float(x1) / x2
+    return score
+
+
+def timed(func, repeat):
+    """Return the min and median durations, in seconds, of `repeat` calls
+    to `func`."""
+    durations = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        durations.append(time.time() - start)
+    durations.sort()
+    return {'min': durations[0], 'median': durations[len(durations) // 2]}
+
+
+def run_size(size, corpus, repeat=5, page_size=20):
+    """Benchmark the search on `size` rows, split between the models."""
+    for model in MODELS:
+        missing = size // len(MODELS) - model.objects.count()
+        if missing > 0:
+            generate(model, missing, corpus)
+    result = {'size': size, 'reindex': {}, 'index': {},
+              'search': {}, 'search_page': {}, 'search_page_snippets': {},
+              'model_search': {}, 'rank': {}, 'rank_legacy': {},
+              'autocomplete': {}, 'suggest': {}}
+    for model in MODELS:
+        start = time.time()
+        for count in reindex(model):
+            pass
+        result['reindex'][model.__name__] = time.time() - start
+        instance = model.objects.order_by('pk').first()
+        # Digest changes on each call, so that the row is always written.
+        suffixes = iter(range(repeat))
+
+        def index():
+            instance.title = u'benchmark {}'.format(next(suffixes))
+            instance.index()
+        result['index'][model.__name__] = timed(index, repeat)
+    for query in QUERIES:
+        result['search'][query] = timed(
+            lambda: list(Search.search(text__match=query)), repeat)
+        result['search_page'][query] = timed(
+            lambda: Search.search(text__match=query).page(1, page_size),
+            repeat)
+        result['search_page_snippets'][query] = timed(
+            lambda: SearchResults(Search.objects.filter(text__match=query),
+                                  snippets=True).page(1, page_size),
+            repeat)
+        result['model_search'][query] = timed(
+            lambda: list(Book.objects.search(query)[:page_size]), repeat)
+        # rank() alone, on the match infos of all the matching rows.
+        infos = list(Search.objects.filter(text__match=query)
+                     .extra(select={'info': 'matchinfo(idx)'})
+                     .values_list('info', flat=True))
+        weights = rank_weights()
+        result['rank'][query] = timed(
+            lambda: [rank(info, *weights) for info in infos], repeat)
+        result['rank_legacy'][query] = timed(
+            lambda: [legacy_rank(info) for info in infos], repeat)
+    for prefix in PREFIXES:
+        # Without the cache of the view.
+        result['autocomplete'][prefix] = timed(
+            lambda: autocomplete_results(prefix_query(prefix), True), repeat)
+    start = time.time()
+    result['vocabulary_terms'] = build_vocabulary()
+    result['build_vocabulary'] = time.time() - start
+    for typo in TYPOS:
+        result['suggest'][typo] = timed(lambda: suggest(typo, True), repeat)
+    return result
+
+
+def text_sizes():
+    """Size, in bytes, of the normalized text of the index and of the
+    original text kept for the snippets."""
+    sizes = []
+    for columns in (TEXT_COLUMNS, ORIGINAL_COLUMNS):
+        sql = ' + '.join('LENGTH(CAST({} AS BLOB))'.format(c)
+                         for c in columns)
+        cursor = connection.cursor()
+        cursor.execute('SELECT COALESCE(SUM({}), 0) FROM idx'.format(sql))
+        sizes.append(cursor.fetchone()[0])
+    return sizes
+
+
+def run(sizes=DEFAULT_SIZES, repeat=5, seed=0, callback=None):
+    """Run the benchmarks for each of the `sizes` and return the report.
+
+    The rows are added to the current database, which should be empty, and
+    are kept from one size to the next. `callback`, if any, is called with
+    the result of each size."""
+    report = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'tokenizer': settings.SEARCH_TOKENIZER,
+        'rank_weights': settings.SEARCH_RANK_WEIGHTS,
+        'repeat': repeat,
+        'seed': seed,
+        'results': [],
+    }
+    corpus = Corpus(seed)
+    for size in sorted(sizes):
+        result = run_size(size, corpus, repeat)
+        result['index_rows'] = Search.objects.count()
+        result['text_size'], result['original_text_size'] = text_sizes()
+        report['results'].append(result)
+        if callback is not None:
+            callback(result)
+    return report
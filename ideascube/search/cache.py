@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import normalize_text
+
+GENERATION_KEY = 'search:generation'
+
+
+def generation():
+    """Return the generation of the index, which changes on every write."""
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # Start from the time, so that a lost counter never goes back to a
+        # value some cached results have been computed with.
+        cache.add(GENERATION_KEY, int(time.time() * 1000), None)
+        value = cache.get(GENERATION_KEY, 0)
+    return value
+
+
+def bump_generation():
+    """Invalidate all the cached results, call after writing the index."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        generation()
+
+
+def query_key(query, public, **filters):
+    """Cache key of the `query`, insensitive to accents and spaces.
+
+    Case is kept: the tokenizer folds it for the terms, but FTS operators
+    are case sensitive ("a OR b" is not "a or b")."""
+    return (u' '.join(normalize_text(query).split()), bool(public),
+            tuple(sorted(filters.items())))
+
+
+class ResultsCache(object):
+    """Least recently used cache of search results, in process.
+
+    Entries are only valid for the generation of the index they have been
+    computed with, and for settings.SEARCH_CACHE_TIMEOUT seconds: with a non
+    shared Django cache, the other processes do not see the generation
+    change. settings.SEARCH_CACHE_SIZE is the maximum number of entries,
+    0 disables the cache."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, compute):
+        """Return the value cached for `key`, or cache and return the result
+        of `compute()`."""
+        current = generation()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if (entry[0] == current and
+                        now - entry[1] < settings.SEARCH_CACHE_TIMEOUT):
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+        value = compute()
+        size = settings.SEARCH_CACHE_SIZE
+        if size > 0:
+            with self._lock:
+                self._entries[key] = (current, now, value)
+                while len(self._entries) > size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'size': len(self._entries),
+            'max_size': settings.SEARCH_CACHE_SIZE,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+results_cache = ResultsCache()
@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ideascube.search.benchmark import DEFAULT_SIZES, run
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the search on synthetic multilingual content, in a '
+            'temporary database, and output a JSON report')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, action='append',
+                            dest='sizes',
+                            help='Number of rows to index, split between '
+                                 'books, documents and blog contents (can be '
+                                 'repeated, default: {}).'.format(
+                                     ', '.join(map(str, DEFAULT_SIZES))))
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of runs of each timing '
+                                 '(default: 5).')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the synthetic content (default: 0).')
+        parser.add_argument('--output', help='Write the report to this file '
+                                             'instead of the standard output.')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'] or DEFAULT_SIZES
+        if min(sizes) < 1 or options['repeat'] < 1:
+            raise CommandError('--size and --repeat must be positive '
+                               'integers.')
+        self.verbosity = options['verbosity']
+        report = self.run_in_temporary_database(
+            sizes, repeat=options['repeat'], seed=options['seed'])
+        data = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
+
+    def run_in_temporary_database(self, sizes, **kwargs):
+        # The 1M rows do not fit in memory: use a file, not :memory:.
+        fd, name = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        previous = test_settings.get('NAME')
+        test_settings['NAME'] = name
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            return run(sizes, callback=self.log, **kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = previous
+
+    def log(self, result):
+        if self.verbosity > 1:
+            self.stderr.write('Benchmarked {} rows.'.format(result['size']))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ideascube.search.spelling import build_vocabulary
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the vocabulary used to correct misspelled searches, '
+            'from the current content of the index')
+
+    def handle(self, *args, **options):
+        count = build_vocabulary()
+        self.stdout.write('Vocabulary of {} words.'.format(count))
@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from ideascube.search.spelling import build_vocabulary
+from ideascube.search.utils import (check_index, index_stats, merge_index,
+                                    optimize_index, set_index_automerge)
+
+
+class Command(BaseCommand):
+    help = ('Maintain the search index: merge its segments, which get '
+            'fragmented when content is added and updated, rebuild the '
+            'vocabulary of the spelling suggestions, and check its '
+            'integrity')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true',
+                            help='Merge all the segments into one (rewrites '
+                                 'the whole index) instead of merging them '
+                                 'incrementally.')
+        parser.add_argument('--pages', type=int, default=100,
+                            help='Pages written per incremental merge step '
+                                 '(default: 100).')
+        parser.add_argument('--segments', type=int, default=8,
+                            help='Minimum number of segments merged per '
+                                 'step (default: 8).')
+        parser.add_argument('--max-seconds', type=float, default=10,
+                            help='Stop merging after this time, to keep the '
+                                 'box responsive (default: 10).')
+        parser.add_argument('--skip-vocabulary', action='store_true',
+                            help='Do not rebuild the vocabulary of the '
+                                 'spelling suggestions.')
+        parser.add_argument('--check', action='store_true',
+                            help='Check the integrity of the index.')
+        parser.add_argument('--automerge', type=int, metavar='SEGMENTS',
+                            help='Let SQLite merge SEGMENTS segments '
+                                 'whenever the index is written, 0 to '
+                                 'disable.')
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running, merging (and checking, with '
+                                 '--check) every SECONDS seconds.')
+
+    def handle(self, *args, **options):
+        if options['pages'] < 1 or options['segments'] < 2:
+            raise CommandError('--pages must be positive and --segments at '
+                               'least 2.')
+        if options['automerge'] is not None:
+            set_index_automerge(options['automerge'])
+        while True:
+            self.maintain(options)
+            if options['check']:
+                self.check()
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def check(self):
+        try:
+            check_index()
+        except DatabaseError as e:
+            raise CommandError('The search index is corrupted ({}), '
+                               'rebuild it with the reindex '
+                               'command.'.format(e))
+        self.stdout.write('The search index is sane.')
+
+    def maintain(self, options):
+        before = index_stats()
+        start = time.time()
+        if options['optimize']:
+            optimize_index()
+        else:
+            merge_index(options['pages'], options['segments'],
+                        options['max_seconds'])
+        after = index_stats()
+        self.stdout.write(
+            'Segments: {} -> {}, size: {} -> {} KB ({:.1f}s).'.format(
+                before['segments'], after['segments'],
+                before['size'] // 1024, after['size'] // 1024,
+                time.time() - start))
+        if not options['skip_vocabulary']:
+            count = build_vocabulary()
+            self.stdout.write('Vocabulary of {} words.'.format(count))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ideascube.search.models import process_index_queue
+
+
+class Command(BaseCommand):
+    help = ('Index the searchable objects queued for indexing (see '
+            'SEARCH_DEFERRED_INDEXING setting)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of objects indexed per transaction '
+                                 '(default: 500).')
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running, processing the queue every '
+                                 'SECONDS seconds.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+        while True:
+            count = process_index_queue(batch_size)
+            if count:
+                self.stdout.write('Indexed {} content.'.format(count))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -1,19 +1,49 @@
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
 
 from ideascube.search.utils import create_index_table
-from ideascube.search.models import SEARCHABLE
+from ideascube.search.models import SEARCHABLE, reindex
+from ideascube.search.spelling import build_vocabulary
 
 
 class Command(BaseCommand):
     help = 'Reindex all the searchable objects'
 
-    def handle(self, *args, **kwargs):
-        create_index_table()
-        for model in SEARCHABLE.values():
-            count = 0
-            for inst in model.objects.all():
-                inst.index()
-                count += 1
-            if count:
-                self.stdout.write('Indexed {} content.'.format(model.__name__))
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models',
+                            choices=sorted(SEARCHABLE.keys()),
+                            help='Only reindex this model (can be repeated).')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of objects indexed per transaction '
+                                 '(default: 500).')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be a positive integer.')
+        names = options['models']
+        if not names:
+            create_index_table()
+            names = SEARCHABLE.keys()
+        for name in sorted(names):
+            self.reindex_model(SEARCHABLE[name], chunk_size)
+        count = build_vocabulary()
+        self.stdout.write('Vocabulary of {} words.'.format(count))
         self.stdout.write('Done reindexing.')
+
+    def reindex_model(self, model, chunk_size):
+        count = 0
+        start = time.time()
+        for count in reindex(model, chunk_size):
+            if self.verbosity > 1:
+                self.stdout.write('{}: {} ({})'.format(
+                    model.__name__, count, self.rate(count, start)))
+        if count:
+            self.stdout.write('Indexed {} {} content ({}).'.format(
+                count, model.__name__, self.rate(count, start)))
+
+    def rate(self, count, start):
+        elapsed = max(time.time() - start, 0.001)
+        return '{:.0f} rows/s'.format(count / elapsed)
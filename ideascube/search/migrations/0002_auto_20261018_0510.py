@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexQueue',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('model', models.CharField(max_length=64)),
+                ('model_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='indexqueue',
+            unique_together=set([('model', 'model_id')]),
+        ),
+    ]
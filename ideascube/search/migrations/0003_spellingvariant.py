@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_auto_20261018_0510'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpellingVariant',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('variant', models.CharField(max_length=100, db_index=True)),
+                ('term', models.CharField(max_length=100)),
+                ('documents', models.IntegerField()),
+            ],
+        ),
+    ]
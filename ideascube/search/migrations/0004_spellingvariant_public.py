@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0003_spellingvariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spellingvariant',
+            name='public',
+            field=models.BooleanField(default=False),
+        ),
+    ]
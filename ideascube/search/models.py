@@ -1,19 +1,40 @@
-from django.db import models
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
+from django.core.urlresolvers import reverse
+from django.db import connection, models, transaction
+from django.db.models import Count
 from django.db.backends.signals import connection_created
 from django.db.models.signals import class_prepared, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils.encoding import force_text
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
-from .utils import rank
+from ideascube.utils import batches
+
+from .cache import bump_generation, query_key, results_cache
+from .utils import (FACET_COLUMNS, HIT_COLUMNS, NOT_INDEXED_COLUMNS,
+                    ORIGINAL_COLUMNS, TEXT_COLUMNS, index_digest,
+                    normalize_text, original_snippet, rank, rank_weights)
 
 
 class Match(models.Lookup):
+    """Full text match on all the indexed columns of the FTS table."""
     lookup_name = 'match'
 
     def as_sql(self, qn, connection):
-        lhs, lhs_params = self.process_lhs(qn, connection)
+        # The hidden column named after the table matches all the columns.
+        lhs = '{0}.{1}'.format(
+            qn.quote_name_unless_alias(self.lhs.alias),
+            connection.ops.quote_name(self.lhs.target.model._meta.db_table))
         rhs, rhs_params = self.process_rhs(qn, connection)
-        params = lhs_params + rhs_params
-        return '{0} MATCH {1}'.format(lhs, rhs), params
+        rhs_params = [normalize_text(p) for p in rhs_params]
+        return '{0} MATCH {1}'.format(lhs, rhs), rhs_params
 
 
 class SearchField(models.Field):
@@ -21,10 +42,105 @@ class SearchField(models.Field):
 SearchField.register_lookup(Match)
 
 
+# Number of tokens of the search snippets, at most 64 for SQLite.
+SNIPPET_TOKENS = 15
+# Markers of the matching terms in the snippets, escaped before being
+# turned into HTML.
+SNIPPET_START = u'\x02'
+SNIPPET_END = u'\x03'
+SNIPPET_ELLIPSIS = u'\u2026'
+
+
+def content_type_sql(column):
+    """SQL of the content type id of the model named in `column`."""
+    types = ContentType.objects.get_for_models(*SEARCHABLE.values())
+    params = []
+    for model, content_type in sorted(types.items(),
+                                      key=lambda i: i[0].__name__):
+        params.extend([model.__name__, content_type.pk])
+    whens = ' '.join(['WHEN %s THEN %s'] * (len(params) // 2))
+    return 'CASE {} {} END'.format(column, whens), params
+
+
 class SearchQuerySet(models.QuerySet):
-    def order_by_relevancy(self):
-        extra = {'relevancy': 'rank(matchinfo(idx))'}
-        return self.extra(select=extra).order_by('-relevancy')
+    def order_by_relevancy(self, weights=None):
+        """Order by rank(), with settings.SEARCH_RANK_WEIGHTS by default."""
+        if weights is None:
+            weights = rank_weights()
+        sql = 'rank(matchinfo(idx){})'.format(', %s' * len(weights))
+        extra = {'relevancy': sql}
+        return self.extra(select=extra,
+                          select_params=weights).order_by('-relevancy')
+
+    def page(self, number, size):
+        """Rows of page `number` (1-based), by pages of `size` rows."""
+        start = (number - 1) * size
+        return self[start:start + size]
+
+    def snippets(self, rowids, tokens=SNIPPET_TOKENS):
+        """HTML snippets of the `rowids` rows, by rowid."""
+        if not rowids:
+            return {}
+        sql = "snippet(idx, %s, %s, %s, -1, %s)"
+        markers = (SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS)
+        rows = (self.filter(rowid__in=rowids).order_by()
+                    .extra(select={'snippet': sql},
+                           select_params=list(markers) + [tokens])
+                    .values_list('rowid', 'snippet', *ORIGINAL_COLUMNS))
+        snippets = {}
+        for row in rows:
+            rowid, snippet = row[:2]
+            # snippet() picks the best matching column.
+            for original in filter(None, row[2:]):
+                original = original_snippet(snippet, original, markers)
+                if original is not None:
+                    snippet = original
+                    break
+            html = escape(snippet).replace(SNIPPET_START, '<mark>')
+            snippets[rowid] = mark_safe(html.replace(SNIPPET_END, '</mark>'))
+        return snippets
+
+    def tagged(self, slug):
+        """Only keep the rows of the instances tagged with `slug`."""
+        content_type, params = content_type_sql('idx.model')
+        return self.extra(where=[
+            'EXISTS (SELECT 1 FROM taggit_taggeditem item '
+            'INNER JOIN taggit_tag tag ON tag.id = item.tag_id '
+            'WHERE tag.slug = %s AND item.object_id = idx.model_id '
+            'AND item.content_type_id = {})'.format(content_type)],
+            params=[slug] + params)
+
+    def facets(self, tags_limit=10):
+        """Count the rows by model, kind and lang, and the most used tags."""
+        counts = dict((name, {}) for name in FACET_COLUMNS)
+        rows = (self.order_by().values_list(*FACET_COLUMNS)
+                    .annotate(count=Count('rowid')))
+        for row in rows:
+            for name, value in zip(FACET_COLUMNS, row):
+                if value:
+                    counts[name][value] = counts[name].get(value, 0) + row[-1]
+        facets = {}
+        for name, values in counts.items():
+            facets[name] = [
+                {'value': value, 'count': count} for value, count in
+                sorted(values.items(), key=lambda i: (-i[1], i[0]))]
+        hits, params = self.order_by().values_list(
+            'model', 'model_id').query.sql_with_params()
+        content_type, types = content_type_sql('hit.model')
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT tag.slug, tag.name, COUNT(*) AS count '
+            'FROM ({}) hit '
+            'INNER JOIN taggit_taggeditem item '
+            'ON item.content_type_id = {} '
+            'AND item.object_id = hit.model_id '
+            'INNER JOIN taggit_tag tag ON tag.id = item.tag_id '
+            'GROUP BY tag.id ORDER BY count DESC, tag.slug '
+            'LIMIT %s'.format(hits, content_type),
+            list(params) + types + [tags_limit])
+        facets['tags'] = [{'value': slug, 'label': name, 'count': count}
+                          for slug, name, count in cursor.fetchall()]
+        return facets
 
 
 class Search(models.Model):
@@ -33,7 +149,18 @@ class Search(models.Model):
     model = models.CharField(max_length=64)
     model_id = models.IntegerField()
     public = models.BooleanField(default=True)
+    lang = models.CharField(max_length=10, blank=True)
+    kind = models.CharField(max_length=10, blank=True)
+    title = SearchField()
     text = SearchField()
+    tags = SearchField()
+    display_title = models.CharField(max_length=300, blank=True)
+    url_name = models.CharField(max_length=100, blank=True)
+    preview = models.CharField(max_length=300, blank=True)
+    digest = models.CharField(max_length=40, blank=True)
+    original_title = models.TextField(blank=True)
+    original_text = models.TextField(blank=True)
+    original_tags = models.TextField(blank=True)
 
     objects = SearchQuerySet.as_manager()
 
@@ -48,9 +175,168 @@ class Search(models.Model):
 
     @classmethod
     def search(cls, **kwargs):
-        qs = Search.objects.filter(**kwargs).order_by_relevancy()
-        for row in qs:
-            yield SEARCHABLE[row.model].objects.get(pk=row.model_id)
+        return SearchResults(Search.objects.filter(**kwargs))
+
+    @classmethod
+    def matching(cls, query, public=False, tag=None, **filters):
+        """Rows matching the full text `query`, with optional filters."""
+        qs = Search.objects.filter(text__match=query, **filters)
+        if public:
+            qs = qs.filter(public=True)
+        if tag:
+            qs = qs.tagged(tag)
+        return qs
+
+    @classmethod
+    def cached_search(cls, query, public=False, hydrate=True, snippets=False,
+                      **filters):
+        """Like SearchResults(matching(...)), with the results cache."""
+        return SearchResults(cls.matching(query, public, **filters),
+                             hydrate=hydrate, snippets=snippets,
+                             cache_key=query_key(query, public, **filters))
+
+    @classmethod
+    def cached_facets(cls, query, public=False, **filters):
+        """Facets of matching(...), cached like cached_search."""
+        key = ('facets', ) + query_key(query, public, **filters)
+        return results_cache.get_or_set(
+            key, lambda: cls.matching(query, public, **filters).facets())
+
+
+class SearchResults(object):
+    """Lazy search results, ranked and loaded one slice at a time."""
+
+    def __init__(self, queryset, hydrate=True, snippets=False,
+                 cache_key=None):
+        self.queryset = queryset
+        self.hydrate = hydrate
+        self.snippets = snippets
+        self.cache_key = cache_key
+        self._count = None
+
+    @property
+    def ranked(self):
+        qs = self.queryset.order_by_relevancy()
+        return qs.values_list(*HIT_COLUMNS)
+
+    def load(self, rows):
+        return hydrate(rows) if self.hydrate else hits(rows)
+
+    def load_slice(self, rows):
+        rows = list(rows)
+        results = list(self.load(rows))
+        if self.snippets:
+            snippets = self.queryset.snippets([row[0] for row in rows])
+            for result in results:
+                result.search_snippet = snippets.get(result.search_rowid)
+        return results
+
+    def ranked_slice(self, start, stop):
+        rows = self.ranked[start:stop]
+        if self.cache_key is None or stop is None:
+            return rows
+        return results_cache.get_or_set(self.cache_key + ('rows', start, stop),
+                                        lambda: list(rows))
+
+    def count(self):
+        if self._count is None:
+            if self.cache_key is None:
+                self._count = self.queryset.count()
+            else:
+                self._count = results_cache.get_or_set(
+                    self.cache_key + ('count', ), self.queryset.count)
+        return self._count
+
+    def __iter__(self):
+        return self.load(self.ranked)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.load_slice(self.ranked_slice(key.start or 0,
+                                                     key.stop))
+        try:
+            return self.load_slice(self.ranked_slice(key, key + 1))[0]
+        except IndexError:
+            raise IndexError('Search results index out of range')
+
+    def page(self, number, size):
+        start = (number - 1) * size
+        return self[start:start + size]
+
+
+class Hit(object):
+    """A search result built from its index row only."""
+
+    def __init__(self, rowid, model, model_id, display_title, url_name,
+                 preview, kind=u''):
+        self.search_rowid = rowid
+        self.model = model
+        self.pk = model_id
+        self.title = display_title
+        self.url_name = url_name
+        self.preview = preview
+        self.kind = kind
+        self.search_snippet = None
+
+    def __str__(self):
+        return self.title
+
+    def __repr__(self):
+        return '<Hit: {} {}>'.format(self.model, self.pk)
+
+    def __eq__(self, other):
+        return (isinstance(other, Hit) and
+                (self.model, self.pk) == (other.model, other.pk))
+
+    def __hash__(self):
+        return hash((self.model, self.pk))
+
+    @property
+    def theme_name(self):
+        """Name of the model, to get its theme (see theme_slug)."""
+        return self.model
+
+    @property
+    def slug(self):
+        """Label of the kind of the instance, if any."""
+        if not self.kind or self.model not in SEARCHABLE:
+            return None
+        try:
+            field = SEARCHABLE[self.model]._meta.get_field('kind')
+        except FieldDoesNotExist:
+            return None
+        return force_text(dict(field.flatchoices).get(self.kind, self.kind))
+
+    def get_absolute_url(self):
+        if not self.url_name:
+            return u''
+        return reverse(self.url_name, kwargs={'pk': self.pk})
+
+
+def hits(rows):
+    """Turn index rows of HIT_COLUMNS into Hit objects."""
+    for row in rows:
+        yield Hit(*row)
+
+
+def hydrate(rows):
+    """Load the instances of the index `rows`, in the same order."""
+    rows = [row[:3] for row in rows]
+    ids = OrderedDict()
+    for rowid, model, model_id in rows:
+        ids.setdefault(model, []).append(model_id)
+    instances = {}
+    for model, pks in ids.items():
+        qs = SEARCHABLE[model].get_search_queryset()
+        instances[model] = {}
+        for batch in batches(pks):
+            instances[model].update(qs.in_bulk(batch))
+    for rowid, model, model_id in rows:
+        # The index may be out of sync with the model table, do not fail.
+        instance = instances[model].get(model_id)
+        if instance is not None:
+            instance.search_rowid = rowid
+            yield instance
 
 
 class SearchMixin(models.Model):
@@ -59,46 +345,271 @@ class SearchMixin(models.Model):
     class Meta:
         abstract = True
 
+    @property
+    def index_title(self):
+        """Indexed in the title column."""
+        return u''
+
     @property
     def index_strings(self):
+        """Indexed in the text column."""
+        return []
+
+    @property
+    def index_tags(self):
+        """Indexed in the tags column."""
         return []
 
     @property
     def index_public(self):
         return True
 
+    @property
+    def index_lang(self):
+        """Stored in the lang column, to filter and count results by."""
+        return u''
+
+    @property
+    def index_kind(self):
+        """Stored in the kind column, to filter and count results by."""
+        return u''
+
+    # Name of the URL of the instance, reversed with its pk: stored with the
+    # title and preview so that results can be rendered from the index.
+    index_url_name = u''
+
+    @property
+    def index_preview(self):
+        """URL of a thumbnail of the instance, if any."""
+        return u''
+
     def is_indexable(self):
         return True
 
+    @classmethod
+    def get_search_queryset(cls):
+        """Queryset used to load search results."""
+        return cls._default_manager.all()
+
+    @classmethod
+    def get_index_queryset(cls):
+        """Queryset used to index many instances at once."""
+        return cls._default_manager.all()
+
+    @property
+    def index_values(self):
+        """Values of the index columns for this instance."""
+        values = dict(
+            public=self.index_public,
+            lang=self.index_lang or u'',
+            kind=self.index_kind or u'',
+            display_title=str(self),
+            url_name=self.index_url_name,
+            preview=self.index_preview or u'')
+        texts = (self.index_title or u'',
+                 u" ".join([s for s in self.index_strings if s]),
+                 u" ".join(self.index_tags))
+        for name, original, text in zip(TEXT_COLUMNS, ORIGINAL_COLUMNS,
+                                        texts):
+            values[name] = normalize_text(text)
+            # Only stored when needed by the snippets.
+            values[original] = text if text != values[name] else u''
+        return values
+
     def index(self):
         if not self.is_indexable():
             return
-        text = u" ".join([s for s in self.index_strings if s])
-        defaults = dict(text=text, public=self.index_public)
-        Search.objects.update_or_create(
+        values = self.index_values
+        values['digest'] = index_digest(values)
+        row = Search.objects.filter(
             model=self.__class__.__name__,
-            model_id=self.pk,
-            defaults=defaults
-        )
+            model_id=self.pk).values_list('rowid', 'digest').first()
+        if row is None:
+            Search.objects.create(model=self.__class__.__name__,
+                                  model_id=self.pk, **values)
+        elif row[1] != values['digest']:
+            Search.objects.filter(rowid=row[0]).update(**values)
+        else:
+            return
+        bump_generation()
 
     def deindex(self):
         Search.objects.filter(
             model=self.__class__.__name__,
             model_id=self.pk).delete()
+        bump_generation()
+
+
+def iter_chunks(queryset, chunk_size):
+    """Yield the instances of `queryset` by lists of `chunk_size`."""
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        qs = queryset if last is None else queryset.filter(pk__gt=last)
+        chunk = list(qs[:chunk_size])
+        if not chunk:
+            break
+        yield chunk
+        last = chunk[-1].pk
+
+
+def bulk_index(instances, replace=True):
+    """Index many instances of the same model at once."""
+    instances = [inst for inst in instances if inst.is_indexable()]
+    if not instances:
+        return 0
+    model = instances[0].__class__.__name__
+    columns = ['model', 'model_id', 'digest']
+    columns.extend(sorted(instances[0].index_values))
+    rows = []
+    for inst in instances:
+        values = inst.index_values
+        row = [model, inst.pk, index_digest(values)]
+        rows.append(row + [values[c] for c in columns[3:]])
+    with transaction.atomic():
+        cursor = connection.cursor()
+        if replace:
+            digests = {}
+            for ids in batches([row[1] for row in rows]):
+                cursor.execute(
+                    'SELECT model_id, digest FROM idx '
+                    'WHERE model=%s AND model_id IN ({})'.format(
+                        ', '.join(['%s'] * len(ids))), [model] + ids)
+                digests.update(cursor.fetchall())
+            rows = [row for row in rows if digests.get(row[1]) != row[2]]
+            stale = [row[1] for row in rows if row[1] in digests]
+            _delete_rows(cursor, model, stale)
+        cursor.executemany(
+            'INSERT INTO idx ({}) VALUES ({})'.format(
+                ', '.join(columns), ', '.join(['%s'] * len(columns))),
+            rows)
+    if rows:
+        bump_generation()
+    return len(rows)
+
+
+def _delete_rows(cursor, model, ids):
+    for batch in batches(ids):
+        cursor.execute(
+            'DELETE FROM idx WHERE model=%s AND model_id IN ({})'.format(
+                ', '.join(['%s'] * len(batch))), [model] + batch)
+    if ids:
+        bump_generation()
+
+
+def reindex(model, chunk_size=500):
+    """Rebuild the index rows of `model`, yielding the count per chunk."""
+    # Not Search.objects...delete(): with the pre_delete receiver, Django
+    # would load every row, full text included, before deleting them.
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM idx WHERE model=%s', [model.__name__])
+    bump_generation()
+    count = 0
+    for chunk in iter_chunks(model.get_index_queryset(), chunk_size):
+        count += bulk_index(chunk, replace=False)
+        yield count
+
+
+class SpellingVariant(models.Model):
+    """A term of the index, or one of its variants, see spelling."""
+    variant = models.CharField(max_length=100, db_index=True)
+    term = models.CharField(max_length=100)
+    documents = models.IntegerField()
+    # Found in the public rows of the index.
+    public = models.BooleanField(default=False)
+
+
+class IndexQueue(models.Model):
+    """Instances waiting to be (re)indexed, see deferred_indexing."""
+    model = models.CharField(max_length=64)
+    model_id = models.IntegerField()
+
+    class Meta:
+        unique_together = ('model', 'model_id')
+
+
+_deferred = threading.local()
+
+
+def indexing_is_deferred():
+    return (settings.SEARCH_DEFERRED_INDEXING or
+            getattr(_deferred, 'depth', 0) > 0)
+
+
+@contextmanager
+def deferred_indexing(batch_size=500):
+    """Queue the instances saved in the block, index them when leaving it."""
+    _deferred.depth = getattr(_deferred, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _deferred.depth -= 1
+        if not indexing_is_deferred():
+            process_index_queue(batch_size)
+
+
+def process_index_queue(batch_size=500):
+    """Index the queued instances. Return the number of rows written."""
+    count = 0
+    while True:
+        with transaction.atomic():
+            batch = list(IndexQueue.objects.order_by('pk')[:batch_size])
+            if not batch:
+                break
+            # Dequeue before reading the instances: a save happening
+            # meanwhile will queue them again.
+            IndexQueue.objects.filter(pk__in=[i.pk for i in batch]).delete()
+            ids = OrderedDict()
+            for item in batch:
+                ids.setdefault(item.model, []).append(item.model_id)
+            for name, pks in ids.items():
+                if name not in SEARCHABLE:
+                    continue
+                qs = SEARCHABLE[name].get_index_queryset()
+                instances = list(qs.filter(pk__in=pks))
+                count += bulk_index(instances)
+                # Deleted since queued.
+                found = set(inst.pk for inst in instances)
+                _delete_rows(connection.cursor(), name,
+                             [pk for pk in pks if pk not in found])
+    return count
 
 
 class SearchableQuerySet(object):
     def search(self, query, **kwargs):
-        kwargs['text__match'] = query
-        kwargs['model'] = self.model.__name__
-        ids = Search.ids(**kwargs)
-        return self.filter(pk__in=ids)
+        """Filter on the full text `query` and order by relevancy."""
+        qn = connection.ops.quote_name
+        index = qn(Search._meta.db_table)
+        where = [
+            '{0}.model = %s'.format(index),
+            '{0}.model_id = {1}.{2}'.format(
+                index, qn(self.model._meta.db_table),
+                qn(self.model._meta.pk.column)),
+            '{0} MATCH %s'.format(index),
+        ]
+        params = [self.model.__name__, normalize_text(query)]
+        for name, value in sorted(kwargs.items()):
+            if name not in NOT_INDEXED_COLUMNS:
+                raise TypeError('Cannot filter search on {!r}'.format(name))
+            where.append('{0}.{1} = %s'.format(index, qn(name)))
+            params.append(value)
+        weights = rank_weights()
+        relevancy = 'rank(matchinfo({0}){1})'.format(index,
+                                                   ', %s' * len(weights))
+        qs = self.extra(tables=[Search._meta.db_table], where=where,
+                        params=params, select={'relevancy': relevancy},
+                        select_params=weights)
+        return qs.order_by('-relevancy')
 
 
 @receiver(post_save)
 def index(sender, instance, **kwargs):
     if SearchMixin in sender.__mro__:
-        instance.index()
+        if indexing_is_deferred():
+            IndexQueue.objects.get_or_create(model=sender.__name__,
+                                             model_id=instance.pk)
+        else:
+            instance.index()
 
 
 @receiver(pre_delete)
@@ -111,7 +622,7 @@ def deindex(sender, instance, **kwargs):
 def add_rank_function(sender, connection, **kwargs):
     if connection.alias == 'burundi':
         return
-    connection.connection.create_function("rank", 1, rank)
+    connection.connection.create_function("rank", -1, rank)
 
 
 @receiver(class_prepared)
@@ -0,0 +1,137 @@
+"""Spelling suggestions from the vocabulary of the search index.
+
+The terms of idx (read from the idx_terms fts4aux table) are stored in the
+SpellingVariant table with all their variants missing one letter, flagged
+as public when the term is found in a public row of the index. The words
+at one edit (insertion, deletion, substitution or transposition) of a word
+share one of these variants, so they are found with a single indexed query,
+whatever the size of the vocabulary."""
+import re
+
+from django.db import connection, transaction
+
+from ideascube.utils import batches
+
+from .cache import bump_generation
+from .models import SpellingVariant
+from .utils import normalize_text
+
+# Shorter words have too many neighbours to be corrected reliably.
+SPELLING_MIN_LENGTH = 4
+# Longer "words" are rather codes, URLs... and have as many variants as
+# letters.
+SPELLING_MAX_LENGTH = 30
+SPELLING_MAX_WORDS = 10
+OPERATORS = ('OR', 'AND', 'NOT', 'NEAR')
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def deletes(word):
+    """The variants of `word` with one of its letters removed."""
+    return set(word[:i] + word[i + 1:] for i in range(len(word)))
+
+
+def edit_distance(a, b):
+    """Number of insertions, deletions, substitutions and transpositions of
+    adjacent letters to turn `a` into `b` (optimal string alignment)."""
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            cost = 0 if x == y else 1
+            value = min(previous[j] + 1, current[j - 1] + 1,
+                        previous[j - 1] + cost)
+            if (i > 1 and j > 1 and x == b[j - 2] and a[i - 2] == y):
+                value = min(value, previous2[j - 2] + 1)
+            current.append(value)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def is_correctable(term):
+    return (SPELLING_MIN_LENGTH <= len(term) <= SPELLING_MAX_LENGTH
+            and term.isalpha())
+
+
+def public_terms(batch_size=5000):
+    """The words of the public rows of the index, lowercased."""
+    cursor = connection.cursor()
+    cursor.execute('SELECT title, text, tags FROM idx WHERE public = %s',
+                   [True])
+    terms = set()
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return terms
+        for row in rows:
+            for text in row:
+                terms.update(WORD.findall((text or u'').lower()))
+
+
+def build_vocabulary(batch_size=5000):
+    """Rebuild the SpellingVariant table from the terms of the index. Return
+    the number of terms."""
+    table = connection.ops.quote_name(SpellingVariant._meta.db_table)
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute("SELECT term, documents FROM idx_terms "
+                       "WHERE col = '*'")
+        terms = [(term, documents) for term, documents in cursor.fetchall()
+                 if is_correctable(term)]
+        public = public_terms()
+        cursor.execute('DELETE FROM {}'.format(table))
+        sql = ('INSERT INTO {} (variant, term, documents, public) '
+               'VALUES (%s, %s, %s, %s)'.format(table))
+        rows = []
+        for term, documents in terms:
+            for variant in deletes(term) | set([term]):
+                rows.append((variant, term, documents, term in public))
+            if len(rows) >= batch_size:
+                cursor.executemany(sql, rows)
+                rows = []
+        cursor.executemany(sql, rows)
+    # Cached suggestions are outdated.
+    bump_generation()
+    return len(terms)
+
+
+def suggest(query, public=False):
+    """Return `query` with its unknown words replaced by the most frequent
+    term at one edit, or None if no word has been corrected. When `public`
+    is True, only the terms of the public rows are suggested."""
+    words = {}
+    for match in WORD.finditer(query):
+        word = match.group(0)
+        if word in OPERATORS or query[match.end():match.end() + 1] == '*':
+            continue
+        term = normalize_text(word).lower()
+        if is_correctable(term):
+            words[word] = term
+        if len(words) == SPELLING_MAX_WORDS:
+            break
+    if not words:
+        return None
+    variants = dict((word, deletes(term) | set([term]))
+                    for word, term in words.items())
+    qs = SpellingVariant.objects.all()
+    if public:
+        qs = qs.filter(public=True)
+    rows = []
+    for batch in batches(sorted(set().union(*variants.values()))):
+        rows.extend(qs.filter(variant__in=batch).values_list(
+            'variant', 'term', 'documents'))
+    corrections = {}
+    for word, term in words.items():
+        candidates = set((other, documents) for variant, other, documents
+                         in rows if variant in variants[word])
+        if any(other == term for other, documents in candidates):
+            continue  # Known word.
+        candidates = sorted((-documents, other)
+                            for other, documents in candidates
+                            if edit_distance(term, other) == 1)
+        if candidates:
+            corrections[word] = candidates[0][1]
+    if not corrections:
+        return None
+    return WORD.sub(lambda m: corrections.get(m.group(0), m.group(0)), query)
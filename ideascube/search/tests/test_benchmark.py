@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from ..benchmark import PREFIXES, QUERIES, TYPOS, run
+
+pytestmark = pytest.mark.django_db
+
+
+def test_benchmark_report():
+    sizes = []
+    report = run(sizes=[30, 60], repeat=1, callback=lambda r: sizes.append(
+        r['size']))
+    assert sizes == [30, 60]
+    assert [r['index_rows'] for r in report['results']] == [31, 61]
+    result = report['results'][-1]
+    assert set(result['reindex']) == set(['Book', 'Document', 'Content'])
+    assert set(result['search']) == set(QUERIES)
+    assert set(result['search_page_snippets']) == set(QUERIES)
+    assert set(result['suggest']) == set(TYPOS)
+    assert set(result['autocomplete']) == set(PREFIXES)
+    assert set(result['rank']) == set(QUERIES)
+    assert set(result['rank_legacy']) == set(QUERIES)
+    # Only the French rows have accents.
+    assert 0 < result['original_text_size'] < result['text_size']
+    assert result['build_vocabulary'] >= 0
+    assert result['index']['Book']['median'] >= 0
+    assert json.loads(json.dumps(report))['results'][0]['size'] == 30
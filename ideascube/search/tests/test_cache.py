@@ -0,0 +1,107 @@
+import pytest
+from django.core.cache import cache
+
+from ideascube.library.tests.factories import BookFactory
+from ideascube.tests.factories import UserFactory
+
+from ..cache import (ResultsCache, bump_generation, generation, query_key,
+                     results_cache)
+from ..models import Search
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    results_cache.clear()
+
+
+@pytest.fixture
+def results():
+    return ResultsCache()
+
+
+def test_query_key_is_normalized():
+    assert query_key(u'  Élève   Music ', True) == (u'Eleve Music', True, ())
+    assert query_key('livre OR cahier', True) != query_key('livre or cahier',
+                                                           True)
+    assert query_key('music', True, lang='fr') == ('music', True,
+                                                    (('lang', 'fr'), ))
+    assert query_key('music', True) != query_key('music', False)
+
+
+def test_get_or_set_computes_once(results):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return ['value']
+
+    assert results.get_or_set('key', compute) == ['value']
+    assert results.get_or_set('key', compute) == ['value']
+    assert len(calls) == 1
+    assert results.stats()['hits'] == 1
+    assert results.stats()['misses'] == 1
+    assert results.stats()['hit_rate'] == 0.5
+
+
+def test_bumping_the_generation_invalidates(results):
+    results.get_or_set('key', lambda: 1)
+    before = generation()
+    bump_generation()
+    assert generation() != before
+    assert results.get_or_set('key', lambda: 2) == 2
+
+
+def test_least_recently_used_is_evicted(results, settings):
+    settings.SEARCH_CACHE_SIZE = 2
+    results.get_or_set('a', lambda: 'a')
+    results.get_or_set('b', lambda: 'b')
+    results.get_or_set('a', lambda: 'new a')
+    results.get_or_set('c', lambda: 'c')
+    assert results.stats()['size'] == 2
+    assert results.get_or_set('a', lambda: 'new a') == 'a'
+    assert results.get_or_set('b', lambda: 'new b') == 'new b'
+
+
+def test_entries_expire(results, settings):
+    settings.SEARCH_CACHE_TIMEOUT = 0
+    results.get_or_set('key', lambda: 1)
+    assert results.get_or_set('key', lambda: 2) == 2
+
+
+def test_size_zero_disables_the_cache(results, settings):
+    settings.SEARCH_CACHE_SIZE = 0
+    results.get_or_set('key', lambda: 1)
+    assert results.get_or_set('key', lambda: 2) == 2
+    assert results.stats()['size'] == 0
+
+
+def test_indexing_invalidates_cached_search():
+    BookFactory(title='music')
+    assert len(list(Search.cached_search('music'))) == 1
+    book = BookFactory(title='music')
+    assert book in list(Search.cached_search('music'))
+    book.delete()
+    assert len(list(Search.cached_search('music'))) == 1
+
+
+def test_unchanged_instance_does_not_invalidate():
+    book = BookFactory(title='music')
+    before = generation()
+    book.save()
+    assert generation() == before
+
+
+def test_cached_search_is_cached_per_visibility():
+    user = UserFactory(serial='ABC123')
+    assert list(Search.cached_search('abc123', public=True)) == []
+    assert list(Search.cached_search('abc123')) == [user]
+
+
+def test_cached_search_keeps_operators_case():
+    BookFactory(title='livre')
+    BookFactory(title='cahier')
+    assert len(list(Search.cached_search('livre OR cahier'))) == 2
+    assert list(Search.cached_search('livre or cahier')) == []
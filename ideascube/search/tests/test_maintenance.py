@@ -0,0 +1,120 @@
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+
+from ideascube.library.tests.factories import BookFactory
+
+from ..models import Search
+from ..spelling import suggest
+from ..utils import (INDEX_PREFIXES, check_index, index_stats, merge_index,
+                     optimize_index, set_index_automerge)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def fragmented():
+    # Pending terms are written to a new segment at each savepoint, like
+    # they are at each commit.
+    for i in range(20):
+        with transaction.atomic():
+            BookFactory(title='music {}'.format(i))
+    with transaction.atomic():
+        pass
+    assert index_stats()['segments'] > 10
+
+
+def test_index_stats(fragmented):
+    stats = index_stats()
+    assert stats['size'] > 0
+    assert sum(stats['levels'].values()) == stats['segments']
+
+
+def test_optimize_index(fragmented):
+    optimize_index()
+    # One segment for the terms, and one per prefix index.
+    assert index_stats()['segments'] == 1 + len(INDEX_PREFIXES)
+    assert Search.search(text__match='music').count() == 20
+
+
+def test_merge_index(fragmented):
+    steps = merge_index(pages=10, segments=2)
+    assert steps > 1
+    assert index_stats()['segments'] < 10
+    assert Search.search(text__match='music').count() == 20
+
+
+def test_merge_index_stops_after_max_seconds(fragmented):
+    assert merge_index(pages=1, segments=2, max_seconds=0) == 1
+
+
+def test_check_index(fragmented):
+    check_index()
+    connection.cursor().execute('DELETE FROM idx_content')
+    with pytest.raises(DatabaseError):
+        check_index()
+
+
+def test_maintain_index_command(fragmented, capsys):
+    call_command('maintain_index', check=True, segments=2)
+    out, err = capsys.readouterr()
+    assert 'Segments: ' in out
+    assert 'The search index is sane.' in out
+    assert 'Vocabulary of ' in out
+
+
+def test_maintain_index_command_checks_on_each_loop(fragmented, capsys,
+                                                  monkeypatch):
+    class Stop(Exception):
+        pass
+
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            raise Stop()
+
+    monkeypatch.setattr('time.sleep', sleep)
+    with pytest.raises(Stop):
+        call_command('maintain_index', check=True, loop=60, max_seconds=0)
+    out, err = capsys.readouterr()
+    assert sleeps == [60, 60]
+    assert out.count('The search index is sane.') == 2
+
+
+def test_maintain_index_command_rebuilds_the_vocabulary(fragmented):
+    call_command('maintain_index', max_seconds=0)
+    assert suggest('musci') == 'music'
+    BookFactory(title='elephant')
+    call_command('maintain_index', max_seconds=0)
+    assert suggest('elephnat') == 'elephant'
+    call_command('maintain_index', max_seconds=0, skip_vocabulary=True)
+    BookFactory(title='gregory')
+    assert suggest('gregroy') is None
+
+
+def test_maintain_index_command_optimize(fragmented, capsys):
+    call_command('maintain_index', optimize=True)
+    out, err = capsys.readouterr()
+    assert '-> {},'.format(1 + len(INDEX_PREFIXES)) in out
+
+
+def test_maintain_index_command_automerge(fragmented):
+    try:
+        call_command('maintain_index', automerge=2, max_seconds=0)
+        for i in range(10):
+            with transaction.atomic():
+                BookFactory(title='music {}'.format(i))
+        assert index_stats()['levels'].get(0, 0) < 10
+    finally:
+        # SQLite keeps the setting in memory, even if rolled back.
+        set_index_automerge(0)
+
+
+def test_maintain_index_command_reports_corruption(fragmented):
+    connection.cursor().execute('DELETE FROM idx_content')
+    with pytest.raises(CommandError):
+        call_command('maintain_index', check=True, optimize=False,
+                     max_seconds=0)
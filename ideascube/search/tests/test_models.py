@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from ideascube.blog.tests.factories import ContentFactory
 from ideascube.blog.models import Content
-from ..models import Search
+from ideascube.library.models import Book
+from ideascube.library.tests.factories import BookFactory
+from ideascube.mediacenter.tests.factories import DocumentFactory
+from ideascube.templatetags.ideascube_tags import theme_slug
+from ..models import (IndexQueue, Search, deferred_indexing,
+                      process_index_queue)
+from ..utils import INDEX_COLUMNS, create_index_table
 
 
 pytestmark = pytest.mark.django_db
@@ -38,3 +46,356 @@ def test_ids_only_returns_ids():
 def test_we_can_search_on_non_fts_fields_only():
     content = ContentFactory(title="music")
     assert content in Search.search(public=False)
+
+
+def test_search_loads_results_with_one_query_per_model():
+    ContentFactory.create_batch(3, title="music")
+    BookFactory.create_batch(3, title="music")
+    DocumentFactory.create_batch(3, title="music")
+    with CaptureQueriesContext(connection) as context:
+        results = list(Search.search(text__match="music"))
+    assert len(results) == 9
+    # One query on the index, then one per model.
+    assert len(context) == 4
+
+
+def test_search_results_keep_relevancy_order_across_models():
+    third = BookFactory(title="About music")
+    first = DocumentFactory(title="About music and music but also music")
+    second = ContentFactory(title="About music and music")
+    assert list(Search.search(text__match="music")) == [first, second, third]
+
+
+def test_rendering_search_results_does_not_hit_the_db():
+    ContentFactory(title="music")
+    BookFactory(title="music")
+    DocumentFactory(title="music")
+    results = list(Search.search(text__match="music"))
+    with CaptureQueriesContext(connection) as context:
+        for result in results:
+            theme_slug(result)
+            result.get_absolute_url()
+            str(result)
+    assert len(context) == 0
+
+
+def test_search_skips_rows_without_instance():
+    content = ContentFactory(title="music")
+    Search.objects.create(model='Content', model_id=content.pk + 1,
+                          text='music')
+    assert list(Search.search(text__match="music")) == [content]
+
+
+def test_search_results_count_does_not_rank():
+    ContentFactory.create_batch(3, title="music")
+    results = Search.search(text__match="music")
+    with CaptureQueriesContext(connection) as context:
+        assert results.count() == 3
+    assert len(context) == 1
+    assert 'rank' not in context.captured_queries[0]['sql']
+
+
+def test_search_results_slicing_limits_the_index_query():
+    first = ContentFactory(title="music music music")
+    second = ContentFactory(title="music music")
+    ContentFactory(title="music")
+    results = Search.search(text__match="music")
+    with CaptureQueriesContext(connection) as context:
+        assert results[:2] == [first, second]
+    assert 'LIMIT 2' in context.captured_queries[0]['sql']
+    assert results[1] == second
+
+
+def test_search_queryset_page():
+    for i in range(5):
+        ContentFactory(title="music")
+    qs = Search.objects.filter(text__match="music")
+    assert len(qs.page(1, 2)) == 2
+    assert len(qs.page(3, 2)) == 1
+    assert len(Search.search(text__match="music").page(2, 2)) == 2
+
+
+def test_rank_weights_can_be_configured(settings):
+    in_title = ContentFactory(title="music", text="nothing")
+    in_text = ContentFactory(title="nothing", text="music music")
+    qs = Search.objects.filter(text__match="music")
+    settings.SEARCH_RANK_WEIGHTS = {}
+    assert [r.relevancy for r in qs.order_by_relevancy()] == [1, 1]
+    settings.SEARCH_RANK_WEIGHTS = {'text': 2}
+    assert list(Search.search(text__match="music")) == [in_text, in_title]
+    weights = [0] * len(INDEX_COLUMNS)
+    assert [r.relevancy for r in qs.order_by_relevancy(weights)] == [0, 0]
+    assert [r.relevancy for r in qs.order_by_relevancy()] != [0, 0]
+    settings.SEARCH_RANK_WEIGHTS = {'title': 0, 'text': 0}
+    assert [r.relevancy for r in qs.order_by_relevancy()] == [0, 0]
+
+
+def test_title_hits_rank_above_text_hits():
+    in_summary = BookFactory(title="A book", summary="music music")
+    in_title = BookFactory(title="music", summary="A book")
+    assert list(Search.search(text__match="music")) == [in_title, in_summary]
+
+
+def test_fields_are_indexed_in_their_own_column():
+    book = BookFactory(title="music", summary="jazz", tags=['blues'])
+    row = Search.objects.get(model='Book')
+    assert row.title == "music"
+    assert "jazz" in row.text
+    assert row.tags == "blues"
+    assert list(Search.search(text__match="tags:blues")) == [book]
+    assert list(Search.search(text__match="title:jazz")) == []
+
+
+def test_not_indexed_columns_are_not_searched():
+    BookFactory(title="music")
+    assert list(Search.search(text__match="Book")) == []
+
+
+def test_index_does_not_write_unchanged_content():
+    content = ContentFactory(title="music")
+    with CaptureQueriesContext(connection) as context:
+        content.index()
+    # Tags and index digest are read, nothing is written.
+    assert not [q for q in context.captured_queries
+                if 'INSERT' in q['sql'] or 'UPDATE' in q['sql']]
+    content.title = "jazz"
+    content.index()
+    assert list(Search.search(text__match="jazz")) == [content]
+    assert Search.objects.filter(model='Content').count() == 1
+
+
+def test_deferred_indexing_queues_then_indexes_on_exit():
+    with deferred_indexing():
+        content = ContentFactory(title="music")
+        content.title = "music and jazz"
+        content.save()
+        assert IndexQueue.objects.count() == 2  # Content and its author.
+        assert not Search.objects.filter(model='Content').exists()
+    assert not IndexQueue.objects.exists()
+    assert list(Search.search(text__match="jazz")) == [content]
+
+
+def test_deferred_indexing_can_be_nested():
+    with deferred_indexing():
+        with deferred_indexing():
+            content = ContentFactory(title="music")
+        assert IndexQueue.objects.exists()
+    assert list(Search.search(text__match="music")) == [content]
+
+
+def test_deferred_indexing_setting_only_queues(settings):
+    settings.SEARCH_DEFERRED_INDEXING = True
+    with deferred_indexing():
+        content = ContentFactory(title="music")
+    assert IndexQueue.objects.count() == 2
+    assert not Search.objects.filter(model='Content').exists()
+    assert process_index_queue(batch_size=1) == 2
+    assert not IndexQueue.objects.exists()
+    assert list(Search.search(text__match="music")) == [content]
+
+
+def test_process_index_queue_deindexes_deleted_instances():
+    content = ContentFactory(title="music")
+    IndexQueue.objects.create(model='Content', model_id=content.pk)
+    Content.objects.filter(pk=content.pk).update(title="jazz")
+    IndexQueue.objects.create(model='Content', model_id=content.pk + 1)
+    Search.objects.create(model='Content', model_id=content.pk + 1,
+                          text='jazz')
+    assert process_index_queue() == 1
+    assert list(Search.search(text__match="jazz")) == [content]
+    assert Search.objects.filter(model='Content').count() == 1
+
+
+def test_process_index_queue_skips_unchanged_instances():
+    content = ContentFactory(title="music")
+    IndexQueue.objects.create(model='Content', model_id=content.pk)
+    assert process_index_queue() == 0
+    assert list(Search.search(text__match="music")) == [content]
+
+
+def test_create_index_table_keeps_an_up_to_date_table():
+    content = ContentFactory(title="music")
+    assert not create_index_table(force=False)
+    assert list(Search.search(text__match="music")) == [content]
+
+
+def test_create_index_table_replaces_an_outdated_table():
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE idx")
+    cursor.execute("CREATE VIRTUAL TABLE idx using "
+                   "FTS4(id, model, model_id, public, text)")
+    assert create_index_table(force=False)
+    assert not create_index_table(force=False)
+
+
+def test_searchable_queryset_is_ordered_by_relevancy():
+    third = BookFactory(title="Other", summary="music")
+    first = BookFactory(title="Music", summary="music")
+    second = BookFactory(title="About music")
+    BookFactory(title="Nothing to see")
+    with CaptureQueriesContext(connection) as context:
+        results = list(Book.objects.search("music"))
+    assert results == [first, second, third]
+    assert len(context) == 1
+    assert 'IN (' not in context.captured_queries[0]['sql']
+
+
+def test_searchable_queryset_only_returns_its_model():
+    book = BookFactory(title="music")
+    ContentFactory(title="music")
+    DocumentFactory(title="music")
+    assert list(Book.objects.search("music")) == [book]
+
+
+def test_searchable_queryset_can_filter_on_public():
+    published = ContentFactory(title="music", status=Content.PUBLISHED)
+    ContentFactory(title="music", status=Content.DRAFT)
+    assert list(Content.objects.search("music", public=True)) == [published]
+
+
+def test_searchable_queryset_refuses_indexed_columns():
+    with pytest.raises(TypeError):
+        Book.objects.search("music", title="music")
+
+
+def test_searchable_queryset_keeps_other_filters():
+    book = BookFactory(title="music", lang="fr")
+    BookFactory(title="music", lang="en")
+    assert list(Book.objects.filter(lang="fr").search("music")) == [book]
+    assert Book.objects.search("music").count() == 2
+
+
+# Indexed text, then queries that should find it: accents, case, Arabic
+# harakat and presentation forms.
+MULTILINGUAL_FIXTURES = {
+    'fr': (u"L'élève découvre la forêt",
+           [u'eleve', u'ÉLÈVE', u'foret', u'découvre', u'élè*']),
+    'ar': (u'كِتَابٌ جَمِيلٌ عن المدرسة',
+           [u'كتاب', u'كِتَاب', u'جميل', u'ﺍﻟﻤﺪﺭﺳﺔ']),
+    'am': (u'ሰላም ለዓለም ትምህርት ቤት', [u'ሰላም', u'ትምህርት']),
+    'so': (u'Dugsiga waxbarashada carruurta', [u'dugsiga', u'CARRUURTA']),
+    'sw': (u'Kitabu cha hadithi za watoto', [u'KITABU', u'hadithi', u'wat*']),
+}
+
+
+def test_multilingual_recall():
+    books = {}
+    for lang, (title, queries) in MULTILINGUAL_FIXTURES.items():
+        books[lang] = BookFactory(title=title, lang=lang)
+    misses = []
+    total = 0
+    for lang, (title, queries) in MULTILINGUAL_FIXTURES.items():
+        for query in queries:
+            total += 1
+            if list(Book.objects.search(query)) != [books[lang]]:
+                misses.append((lang, query))
+    recall = (total - len(misses)) / total
+    assert recall == 1.0, misses
+
+
+def test_changing_the_tokenizer_outdates_the_index_table(settings):
+    settings.SEARCH_TOKENIZER = 'simple'
+    assert create_index_table(force=False)
+    assert not create_index_table(force=False)
+
+
+def test_facets_count_by_model_kind_and_lang():
+    BookFactory.create_batch(2, title="music", lang='fr')
+    BookFactory(title="music", lang='ar')
+    DocumentFactory(title="music", lang='fr', kind='pdf')
+    DocumentFactory(title="other", lang='fr', kind='pdf')
+    facets = Search.matching("music", model__in=['Book', 'Document']).facets()
+    assert facets['model'] == [{'value': 'Book', 'count': 3},
+                               {'value': 'Document', 'count': 1}]
+    assert facets['kind'] == [{'value': 'pdf', 'count': 1}]
+    assert facets['lang'] == [{'value': 'fr', 'count': 3},
+                              {'value': 'ar', 'count': 1}]
+
+
+def test_facets_return_the_most_used_tags():
+    BookFactory.create_batch(2, title="music", tags=['jazz', 'blues'])
+    DocumentFactory(title="music", tags=['jazz', 'rock'])
+    BookFactory(title="other", tags=['rock'])
+    facets = Search.matching("music").facets(tags_limit=2)
+    assert facets['tags'] == [
+        {'value': 'jazz', 'label': 'jazz', 'count': 3},
+        {'value': 'blues', 'label': 'blues', 'count': 2}]
+
+
+def test_facets_use_two_queries():
+    BookFactory.create_batch(3, title="music", tags=['jazz'])
+    DocumentFactory.create_batch(3, title="music", tags=['jazz'])
+    # Content types are then cached by the process.
+    Search.matching("music").facets()
+    with CaptureQueriesContext(connection) as context:
+        Search.matching("music").facets()
+    assert len(context) == 2
+
+
+def test_tags_are_joined_on_the_content_type_ids():
+    BookFactory(title="music", tags=['jazz'])
+    Search.matching("music").facets()
+    with CaptureQueriesContext(connection) as context:
+        assert Search.matching("music").facets()['tags'][0]['count'] == 1
+        assert Search.matching("music", tag='jazz').count() == 1
+    sql = ' '.join(q['sql'] for q in context.captured_queries)
+    assert 'django_content_type' not in sql
+    assert 'lower(' not in sql
+
+
+def test_matching_can_filter_on_facets():
+    book = BookFactory(title="music", lang='fr', tags=['jazz'])
+    BookFactory(title="music", lang='ar', tags=['jazz'])
+    document = DocumentFactory(title="music", lang='fr', kind='pdf',
+                               tags=['rock'])
+    DocumentFactory(title="music", lang='fr', kind='image')
+
+    def search(**kwargs):
+        return set(Search.search(pk__in=Search.matching("music", **kwargs)))
+    assert search(lang='fr', tag='jazz') == set([book])
+    assert search(kind='pdf') == set([document])
+    assert search(model='Document', tag='rock') == set([document])
+
+
+def test_snippets_highlight_the_matching_terms():
+    BookFactory(title="Other", summary="A <b>long</b> story about music.")
+    results = Search.search(text__match="music")
+    results.snippets = True
+    snippet = results[0].search_snippet
+    assert snippet == ('A &lt;b&gt;long&lt;/b&gt; story about '
+                       '<mark>music</mark>.')
+
+
+def test_snippets_show_the_original_text():
+    BookFactory(title="Other", summary=u"Un élève lit le كِتَابٌ.")
+    results = Search.search(text__match="eleve")
+    results.snippets = True
+    assert results[0].search_snippet == (
+        u'Un <mark>élève</mark> lit le كِتَابٌ.')
+    results = Search.search(text__match=u"كتاب")
+    results.snippets = True
+    assert results[0].search_snippet == (
+        u'Un élève lit le <mark>كِتَابٌ</mark>.')
+
+
+def test_snippets_are_capped():
+    words = ['word'] * 5000
+    BookFactory(title="Other", summary=' '.join(words + ['music'] + words))
+    results = Search.search(text__match="music")
+    results.snippets = True
+    snippet = results[0].search_snippet
+    assert '<mark>music</mark>' in snippet
+    assert len(snippet.split()) <= 15
+
+
+def test_snippets_are_only_computed_for_the_page():
+    BookFactory.create_batch(10, title="music")
+    results = Search.search(text__match="music")
+    results.snippets = True
+    with CaptureQueriesContext(connection) as context:
+        page = results.page(2, 3)
+    snippet_queries = [q for q in context.captured_queries
+                       if 'snippet(' in q['sql']]
+    assert len(snippet_queries) == 1
+    assert all('<mark>' in result.search_snippet for result in page)
+    assert list(results)[0].search_rowid
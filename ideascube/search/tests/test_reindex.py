@@ -0,0 +1,74 @@
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ideascube.blog.tests.factories import ContentFactory
+from ideascube.library.models import Book
+from ideascube.library.tests.factories import BookFactory
+from ideascube.mediacenter.tests.factories import DocumentFactory
+
+from ..models import Search
+
+pytestmark = pytest.mark.django_db
+
+
+def test_reindex_rebuilds_the_index():
+    content = ContentFactory(title="music")
+    book = BookFactory(title="music", tags=['jazz'])
+    Search.objects.all().delete()
+    call_command('reindex')
+    assert Search.objects.count() == 3  # Content author is indexed too.
+    assert set(Search.search(text__match="music")) == set([content, book])
+    assert list(Search.search(text__match="jazz")) == [book]
+
+
+def test_reindex_can_be_limited_to_one_model():
+    content = ContentFactory(title="music")
+    book = BookFactory(title="music")
+    Search.objects.filter(model='Book').update(text='nothing')
+    call_command('reindex', models=['Book'])
+    assert Search.objects.filter(model='Book').count() == 1
+    assert set(Search.search(text__match="music")) == set([content, book])
+
+
+def test_reindex_writes_by_chunks(capsys):
+    BookFactory.create_batch(7, title="music", tags=['jazz', 'blues'])
+    with CaptureQueriesContext(connection) as context:
+        call_command('reindex', models=['Book'], chunk_size=3)
+    out, err = capsys.readouterr()
+    assert 'Indexed 7 Book content' in out
+    assert 'rows/s' in out
+    assert Search.objects.filter(model='Book').count() == 7
+    # No query per book: for each chunk of 3 books, load the books, their
+    # tags and write the rows.
+    selects = [q for q in context.captured_queries if 'SELECT' in q['sql']]
+    assert 0 < len(selects) < 7 * 2
+
+
+def test_reindex_uses_prefetched_tags():
+    book = BookFactory(tags=['jazz', 'blues'])
+    book = Book.get_index_queryset().get(pk=book.pk)
+    with CaptureQueriesContext(connection) as context:
+        assert list(book.tags.names()) == ['blues', 'jazz']
+        book.index_values
+    assert len(context) == 0
+
+
+def test_reindex_skips_nothing_with_small_chunks():
+    DocumentFactory.create_batch(5)
+    call_command('reindex', models=['Document'], chunk_size=1)
+    assert Search.objects.filter(model='Document').count() == 5
+
+
+def test_reindex_deletes_the_rows_without_loading_them():
+    BookFactory.create_batch(3, title="music")
+    with CaptureQueriesContext(connection) as context:
+        call_command('reindex', models=['Book'])
+    deletes = [q['sql'] for q in context.captured_queries
+               if 'DELETE FROM' in q['sql'] and 'idx' in q['sql']]
+    assert len(deletes) == 1
+    assert 'rowid IN' not in deletes[0]
+    assert not [q for q in context.captured_queries
+                if 'SELECT' in q['sql'] and '"idx"."text"' in q['sql']]
+    assert Search.objects.filter(model='Book').count() == 3
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ideascube.library.tests.factories import BookFactory
+from ideascube.tests.factories import UserFactory
+from ideascube.utils import batches
+
+from .. import spelling
+from ..models import SpellingVariant
+from ..spelling import (SPELLING_MAX_LENGTH, SPELLING_MAX_WORDS,
+                        build_vocabulary, deletes, edit_distance, suggest)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def vocabulary():
+    BookFactory(title='Gregory and the elephants', summary='')
+    BookFactory(title='Elephant music', summary='')
+    BookFactory(title='Elephant stories', summary='')
+    BookFactory(title=u'Une école', summary='')
+    # Terms are only visible to fts4aux once flushed, which happens on
+    # commit, but tests run in a transaction.
+    connection.cursor().execute("INSERT INTO idx(idx) VALUES('optimize')")
+    return build_vocabulary()
+
+
+@pytest.mark.parametrize('a,b,distance', [
+    ('music', 'music', 0),
+    ('music', 'muzic', 1),
+    ('music', 'musci', 1),
+    ('music', 'musics', 1),
+    ('music', 'usic', 1),
+    ('music', 'muzik', 2),
+    ('', 'abc', 3),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b) == distance
+
+
+def test_deletes():
+    assert deletes('abc') == set(['bc', 'ac', 'ab'])
+
+
+def test_build_vocabulary(vocabulary):
+    # "and", "the" and "une" are too short.
+    terms = set(SpellingVariant.objects.values_list('term', flat=True))
+    assert terms == set(['gregory', 'elephants', 'elephant', 'music',
+                         'stories', 'ecole'])
+    assert vocabulary == len(terms)
+    assert SpellingVariant.objects.filter(term='elephant',
+                                          variant='elphant').exists()
+    assert SpellingVariant.objects.filter(public=False).count() == 0
+
+
+def test_build_vocabulary_flags_the_public_terms():
+    BookFactory(title='Gregory', summary='')
+    UserFactory(short_name='Elephant', serial='serial')
+    connection.cursor().execute("INSERT INTO idx(idx) VALUES('optimize')")
+    build_vocabulary()
+    public = set(SpellingVariant.objects.filter(public=True)
+                                        .values_list('term', flat=True))
+    assert public == set(['gregory'])
+    assert suggest('elephnat') == 'elephant'
+    assert suggest('elephnat', public=True) is None
+    assert suggest('gregroy', public=True) == 'gregory'
+
+
+@pytest.mark.parametrize('query,expected', [
+    ('gregroy', 'gregory'),
+    ('Gregry', 'gregory'),
+    ('grregory', 'gregory'),
+    ('gregori', 'gregory'),
+    ('elefant', None),
+    ('eleplant music', 'elephant music'),
+    ('music OR eleplant', 'music OR elephant'),
+    (u'écolle', 'ecole'),
+    ('music', None),
+    ('elep*', None),
+    ('mosic', 'music'),
+    ('muzk', None),
+    ('gregroy' * 5, None),
+])
+def test_suggest(vocabulary, query, expected):
+    assert suggest(query) == expected
+
+
+def test_suggest_prefers_the_most_frequent_term(vocabulary):
+    # Both "elephant" (2 documents) and "elephants" (1) are one edit away.
+    assert suggest('elephans') == 'elephant'
+
+
+def test_suggest_looks_up_the_candidates_with_one_indexed_query(vocabulary):
+    with CaptureQueriesContext(connection) as context:
+        assert suggest('gregroy music') == 'gregory music'
+    assert len(context) == 1
+    sql = context.captured_queries[0]['sql']
+    assert '"search_spellingvariant"."variant" IN' in sql
+    # Latency on large vocabularies is measured by benchmark_search.
+    rows = SpellingVariant.objects.filter(variant__in=['gregry', 'music'])
+    sql, params = rows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = ' '.join(str(row) for row in cursor.fetchall())
+    assert 'USING INDEX' in plan
+
+
+def test_suggest_batches_the_candidates_lookup(vocabulary, monkeypatch):
+    monkeypatch.setattr(spelling, 'batches',
+                        lambda values: batches(values, 50))
+    # Up to 10 words of 30 letters, with 31 variants each.
+    words = [''.join(chr(ord('a') + (i + j) % 26)
+                     for j in range(SPELLING_MAX_LENGTH))
+             for i in range(SPELLING_MAX_WORDS - 1)] + ['gregroy']
+    with CaptureQueriesContext(connection) as context:
+        assert suggest(' '.join(words)) == ' '.join(words[:-1] + ['gregory'])
+    assert len(context) > 1
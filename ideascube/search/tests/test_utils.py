@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import random
+import sqlite3
+
+import pytest
+
+from ..benchmark import legacy_rank
+from ..utils import normalize_text, original_snippet, prefix_query, rank
+
+WORDS = ['music', 'book', 'moon', 'river', 'school', 'water', 'garden',
+         'story', 'market', 'child']
+
+
+@pytest.fixture(scope='module')
+def match_infos():
+    random.seed(42)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE VIRTUAL TABLE t USING FTS4(title, text)')
+    for i in range(500):
+        db.execute('INSERT INTO t (title, text) VALUES (?, ?)', (
+            ' '.join(random.choice(WORDS) for _ in range(5)),
+            ' '.join(random.choice(WORDS) for _ in range(50))))
+    rows = db.execute("SELECT rowid, matchinfo(t) FROM t "
+                      "WHERE t MATCH 'music OR moon'").fetchall()
+    db.close()
+    return rows
+
+
+def test_rank_without_match_info_is_zero():
+    assert rank(None) == 0.0
+    assert rank(b'') == 0.0
+
+
+def test_rank_scores_like_legacy_rank(match_infos):
+    for rowid, match_info in match_infos:
+        assert round(rank(match_info), 9) == round(legacy_rank(match_info), 9)
+
+
+def test_rank_orders_like_legacy_rank(match_infos):
+    def order(func):
+        return [rowid for rowid, info in
+                sorted(match_infos, key=lambda r: (-func(r[1]), r[0]))]
+    assert order(rank) == order(legacy_rank)
+
+
+def test_rank_weights_columns(match_infos):
+    for rowid, match_info in match_infos:
+        title_only = rank(match_info, 1, 0)
+        text_only = rank(match_info, 0, 1)
+        assert round(title_only + text_only, 9) == round(rank(match_info), 9)
+        assert round(rank(match_info, 2, 0), 9) == round(2 * title_only, 9)
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('gre', 'gre*'),
+    ('the gre', 'the gre*'),
+    ('  Gre!  ', 'Gre*'),
+    ('"gr" OR', 'gr OR*'),
+    ('the g', ''),
+    ('', ''),
+])
+def test_prefix_query(text, expected):
+    assert prefix_query(text) == expected
+
+
+@pytest.mark.parametrize('text,expected', [
+    (u'Élève à la forêt', u'Eleve a la foret'),
+    (u'كِتَابٌ', u'كتاب'),
+    (u'ሰላም', u'ሰላም'),
+    (u'ﺍﻟﻤﺪﺭﺳﺔ', u'المدرسة'),
+])
+def test_normalize_text(text, expected):
+    assert normalize_text(text) == expected
+
+
+@pytest.mark.parametrize('snippet,original,expected', [
+    (u'<b>eleve</b> a', u'Un élève à la forêt', u'<b>élève</b> à'),
+    (u'<b>eleve</b> a', u'Un e\u0301le\u0300ve a',
+     u'<b>e\u0301le\u0300ve</b> a'),
+    (u'\u2026<b>eleve</b>', u'Un élève', u'\u2026<b>élève</b>'),
+    (u'<b>كتاب</b>', u'كِتَابٌ جميل', u'<b>كِتَابٌ</b>'),
+    (u'a <b>b</b>', u'à\xa0b', u'à\xa0<b>b</b>'),
+    (u'<b>other</b>', u'Un élève', None),
+])
+def test_original_snippet(snippet, original, expected):
+    markers = (u'<b>', u'</b>', u'\u2026')
+    assert original_snippet(snippet, original, markers) == expected
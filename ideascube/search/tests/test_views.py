@@ -1,14 +1,34 @@
 import pytest
 
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 
 from ideascube.blog.tests.factories import ContentFactory
 from ideascube.blog.models import Content
+from ideascube.library.models import Book
 from ideascube.library.tests.factories import BookFactory
+from ideascube.mediacenter.models import Document
+from ideascube.mediacenter.tests.factories import DocumentFactory
+from ideascube.tests.factories import UserFactory
+
+from ..cache import results_cache
+from ..models import Hit
+from ..spelling import build_vocabulary
+from ..views import autocomplete
 
 pytestmark = pytest.mark.django_db
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    results_cache.clear()
+
+
 def test_search_view_should_show_results(app):
     content = ContentFactory(title='test content', status=Content.PUBLISHED)
     form = app.get(reverse('search:search')).forms['search']
@@ -73,3 +93,242 @@ def test_search_view_should_return_mixed_content(app):
     page = form.submit()
     assert content.title in page.content.decode()
     assert book.title in page.content.decode()
+
+
+def test_search_view_should_paginate_results(app):
+    for i in range(25):
+        ContentFactory(title='test content', status=Content.PUBLISHED)
+    page = app.get(reverse('search:search'), params={'q': 'test'})
+    assert len(page.pyquery('ul.results li')) == 20
+    assert 'Page 1 of 2' in page.content.decode()
+    page = page.click(href='page=2', index=0)
+    assert len(page.pyquery('ul.results li')) == 5
+    assert 'Page 2 of 2' in page.content.decode()
+
+
+def test_search_view_should_accept_a_page_size(app):
+    for i in range(5):
+        ContentFactory(title='test content', status=Content.PUBLISHED)
+    page = app.get(reverse('search:search'),
+                   params={'q': 'test', 'page_size': 2})
+    assert len(page.pyquery('ul.results li')) == 2
+    assert 'Page 1 of 3' in page.content.decode()
+
+
+def test_search_view_should_bound_the_page_size(app):
+    for i in range(3):
+        ContentFactory(title='test content', status=Content.PUBLISHED)
+    page = app.get(reverse('search:search'),
+                   params={'q': 'test', 'page_size': 0})
+    assert len(page.pyquery('ul.results li')) == 1
+
+
+def test_autocomplete_should_return_prefix_matches(app):
+    book = BookFactory(title='Gregory and the cat')
+    BookFactory(title='Another book')
+    response = app.get(reverse('search:autocomplete'), params={'q': 'the gr'})
+    assert response.json['results'] == [{
+        'label': 'Gregory and the cat',
+        'url': book.get_absolute_url(),
+        'model': 'Book',
+        'preview': book.cover.url,
+    }]
+
+
+def test_autocomplete_should_need_two_characters(app):
+    BookFactory(title='Gregory')
+    response = app.get(reverse('search:autocomplete'), params={'q': 'g'})
+    assert response.json['results'] == []
+
+
+def test_autocomplete_should_be_limited_to_ten_results(app):
+    BookFactory.create_batch(12, title='Gregory')
+    response = app.get(reverse('search:autocomplete'), params={'q': 'greg'})
+    assert len(response.json['results']) == 10
+
+
+def test_autocomplete_should_not_return_private_content_to_anonymous(app):
+    UserFactory(serial='ABC123')
+    response = app.get(reverse('search:autocomplete'), params={'q': 'abc'})
+    assert response.json['results'] == []
+
+
+def test_autocomplete_should_return_users_to_staff(staffapp):
+    user = UserFactory(serial='ABC123', short_name='', full_name='')
+    response = staffapp.get(reverse('search:autocomplete'),
+                            params={'q': 'abc'})
+    assert response.json['results'][0]['label'] == user.serial
+
+
+def test_autocomplete_should_be_cached_per_prefix(app):
+    BookFactory(title='Gregory')
+    url = reverse('search:autocomplete')
+    app.get(url, params={'q': 'greg'})
+    with CaptureQueriesContext(connection) as context:
+        response = app.get(url, params={'q': 'greg'})
+    assert not [q for q in context.captured_queries if 'idx' in q['sql']]
+    assert len(response.json['results']) == 1
+    # Counted with the search results.
+    assert results_cache.stats()['hits'] == 1
+
+
+def test_autocomplete_ranks_only_the_first_results():
+    BookFactory.create_batch(12, title='Gregory')
+    request = RequestFactory().get('/', {'q': 'greg'})
+    request.user = AnonymousUser()
+    # Latency on large indexes is measured by benchmark_search.
+    with CaptureQueriesContext(connection) as context:
+        response = autocomplete(request)
+    assert response.status_code == 200
+    ranked = [q['sql'] for q in context.captured_queries
+              if 'rank(' in q['sql']]
+    assert len(ranked) == 1
+    assert 'LIMIT 10' in ranked[0]
+    assert len(context) == 1
+
+
+def test_search_results_are_cached(app):
+    BookFactory(title='music')
+    app.get(reverse('search:search'), params={'q': 'music'})
+    with CaptureQueriesContext(connection) as context:
+        response = app.get(reverse('search:search'),
+                           params={'q': ' music '})
+    assert 'music' in response.content.decode()
+    # Only the snippets of the page are computed again.
+    assert not [q for q in context.captured_queries
+                if 'idx' in q['sql'] and 'snippet(' not in q['sql']]
+    # The count, the hits of the page and the facets.
+    assert results_cache.stats()['hits'] == 3
+
+
+def test_search_only_caches_the_page_shown(app):
+    BookFactory.create_batch(3, title='music')
+    with CaptureQueriesContext(connection) as context:
+        app.get(reverse('search:search'), params={'q': 'music',
+                                                  'page_size': 2})
+    ranked = [q['sql'] for q in context.captured_queries
+              if 'rank(' in q['sql']]
+    assert len(ranked) == 1
+    assert 'LIMIT 2' in ranked[0]
+    rows = [value for key, value in results_cache._entries.items()
+            if 'rows' in key]
+    assert [len(value[2]) for value in rows] == [2]
+    app.get(reverse('search:search'), params={'q': 'music', 'page_size': 2,
+                                              'page': 2})
+    rows = [value for key, value in results_cache._entries.items()
+            if 'rows' in key]
+    assert sorted(len(value[2]) for value in rows) == [1, 2]
+
+
+def test_autocomplete_cache_is_invalidated_by_indexing(app):
+    url = reverse('search:autocomplete')
+    BookFactory(title='Gregory')
+    assert len(app.get(url, params={'q': 'greg'}).json['results']) == 1
+    BookFactory(title='Gregory')
+    assert len(app.get(url, params={'q': 'greg'}).json['results']) == 2
+
+
+def test_cache_stats_are_not_for_anonymous(app):
+    app.get(reverse('search:cache_stats'), status=302)
+
+
+def test_cache_stats_are_for_staff(staffapp):
+    response = staffapp.get(reverse('search:cache_stats'))
+    assert set(response.json) == set(['hits', 'misses', 'hit_rate', 'size',
+                                      'max_size'])
+
+
+def test_search_page_shows_facets(app):
+    BookFactory(title='music', lang='fr', tags=['jazz'])
+    response = app.get(reverse('search:search'), params={'q': 'music'})
+    facets = response.context['facets']
+    assert facets['model'][0]['count'] == 1
+    assert facets['lang'][0]['value'] == 'fr'
+    assert facets['tags'][0]['label'] == 'jazz'
+    assert 'tag=jazz' in facets['tags'][0]['url']
+    assert 'jazz' in response.pyquery('.facets').text()
+
+
+def test_search_page_can_be_filtered_by_facet(app):
+    book = BookFactory(title='music', lang='fr')
+    BookFactory(title='music', lang='en')
+    ContentFactory(title='music', lang='fr', status=Content.PUBLISHED)
+    response = app.get(reverse('search:search'),
+                       params={'q': 'music', 'model': 'Book', 'lang': 'fr'})
+    assert list(response.context['results']) == [
+        Hit(None, 'Book', book.pk, '', '', '')]
+    assert response.context['filters'][0]['name'] == 'lang'
+    assert [f['value'] for f in response.context['facets']['lang']] == ['fr']
+
+
+def test_search_page_ignores_unknown_filters(app):
+    BookFactory(title='music')
+    response = app.get(reverse('search:search'),
+                       params={'q': 'music', 'title': 'other'})
+    assert len(response.context['results']) == 1
+
+
+def test_search_retries_with_the_spelling_suggestion(app):
+    book = BookFactory(title='Gregory')
+    connection.cursor().execute("INSERT INTO idx(idx) VALUES('optimize')")
+    build_vocabulary()
+    response = app.get(reverse('search:search'), params={'q': 'gregroy'})
+    assert list(response.context['results']) == [
+        Hit(None, 'Book', book.pk, '', '', '')]
+    assert response.context['suggestion'] == 'gregory'
+    assert 'showing results for' in response.pyquery('.suggestion').text()
+
+
+def test_search_does_not_suggest_private_terms(app):
+    UserFactory(short_name='Gregory')
+    connection.cursor().execute("INSERT INTO idx(idx) VALUES('optimize')")
+    build_vocabulary()
+    response = app.get(reverse('search:search'), params={'q': 'gregroy'})
+    assert response.context['suggestion'] is None
+    assert 'Gregory' not in response
+
+
+def test_search_does_not_suggest_terms_without_results(app):
+    BookFactory(title='Gregory', lang='fr')
+    connection.cursor().execute("INSERT INTO idx(idx) VALUES('optimize')")
+    build_vocabulary()
+    response = app.get(reverse('search:search'),
+                       params={'q': 'gregroy', 'lang': 'en'})
+    assert response.context['suggestion'] is None
+    assert list(response.context['results']) == []
+
+
+def test_search_page_renders_from_the_index_only(app):
+    BookFactory.create_batch(3, title='music')
+    ContentFactory.create_batch(3, title='music', status=Content.PUBLISHED)
+    with CaptureQueriesContext(connection) as context:
+        response = app.get(reverse('search:search'), params={'q': 'music'})
+    tables = ' '.join(q['sql'] for q in context.captured_queries)
+    assert 'library_book' not in tables
+    assert 'blog_content' not in tables
+    links = response.pyquery('.results a')
+    assert len(links) == 6
+    assert links.eq(0).text() == 'music'
+    assert len(response.pyquery('.results .theme.read')) == 3
+    assert len(response.pyquery('.results .theme.create')) == 3
+
+
+def test_search_page_shows_the_kind_of_documents(app):
+    DocumentFactory(title='music', kind=Document.VIDEO)
+    BookFactory(title='music')
+    response = app.get(reverse('search:search'), params={'q': 'music'})
+    assert response.pyquery('.results .theme.discover').text() == 'video'
+    assert response.pyquery('.results .theme.read').text() == 'book'
+
+
+def test_search_page_can_hydrate_the_results(app, settings):
+    settings.SEARCH_HYDRATE_RESULTS = True
+    book = BookFactory(title='music')
+    response = app.get(reverse('search:search'), params={'q': 'music'})
+    assert list(response.context['results']) == [book]
+
+
+def test_search_page_shows_snippets(app):
+    BookFactory(title='Other', summary='A story about music and more.')
+    response = app.get(reverse('search:search'), params={'q': 'music'})
+    assert response.pyquery('.snippet mark').text() == 'music'
@@ -4,4 +4,6 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.search, name='search'),
+    url(r'^autocomplete/$', views.autocomplete, name='autocomplete'),
+    url(r'^cache-stats/$', views.cache_stats, name='cache_stats'),
 ]
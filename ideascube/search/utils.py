@@ -1,20 +1,218 @@
+import hashlib
+import re
 import struct
+import time
+import unicodedata
+from itertools import cycle
 
+from django.conf import settings
 from django.db import connection
+from django.utils import six
+
+# Columns of the idx FTS table, in the order of the table definition.
+INDEX_COLUMNS = ('model', 'model_id', 'public', 'lang', 'kind', 'title',
+                 'text', 'tags', 'display_title', 'url_name', 'preview',
+                 'digest', 'original_title', 'original_text',
+                 'original_tags')
+# Columns only stored, not full-text indexed.
+NOT_INDEXED_COLUMNS = ('model', 'model_id', 'public', 'lang', 'kind',
+                       'display_title', 'url_name', 'preview', 'digest',
+                       'original_title', 'original_text', 'original_tags')
+# Full-text indexed columns, whose text is normalized (see normalize_text),
+# and the columns keeping their text as it was, when it differs, to show it
+# in the snippets.
+TEXT_COLUMNS = ('title', 'text', 'tags')
+ORIGINAL_COLUMNS = ('original_title', 'original_text', 'original_tags')
+# Columns needed to render a result without loading the instance, see Hit.
+HIT_COLUMNS = ('rowid', 'model', 'model_id', 'display_title', 'url_name',
+               'preview', 'kind')
+# Columns the search results can be counted by, see SearchQuerySet.facets.
+FACET_COLUMNS = ('model', 'kind', 'lang')
+# Lengths of the prefixes indexed, to speed up autocompletion.
+INDEX_PREFIXES = (2, 3)
+
+
+def index_table_sql():
+    options = list(INDEX_COLUMNS)
+    options.extend('notindexed={}'.format(c) for c in NOT_INDEXED_COLUMNS)
+    options.append('prefix="{}"'.format(','.join(map(str, INDEX_PREFIXES))))
+    options.append('tokenize={}'.format(settings.SEARCH_TOKENIZER))
+    return 'CREATE VIRTUAL TABLE idx USING FTS4({})'.format(', '.join(options))
+
+
+# Terms of the idx table, with their number of documents and occurrences.
+TERMS_TABLE_SQL = ('CREATE VIRTUAL TABLE IF NOT EXISTS idx_terms '
+                   'USING fts4aux(idx)')
 
 
 def create_index_table(force=True):
+    """Create the idx table, and the idx_terms table reading its terms.
+
+    Unless `force` is True, an existing table is only dropped when its
+    definition is outdated. Return True if the table has been (re)created,
+    in which case it needs to be reindexed."""
     cursor = connection.cursor()
-    cursor.execute("SELECT count(*) FROM sqlite_master "
+    cursor.execute("SELECT sql FROM sqlite_master "
                    "WHERE type='table' AND name='idx';")
-    count = cursor.fetchone()[0]
-    if not count or force:
-        cursor.execute("DROP TABLE IF EXISTS idx")
-        cursor.execute("CREATE VIRTUAL TABLE idx using "
-                       "FTS4(id, model, model_id, public, text)")
+    row = cursor.fetchone()
+    if row and row[0] == index_table_sql() and not force:
+        cursor.execute(TERMS_TABLE_SQL)
+        return False
+    cursor.execute("DROP TABLE IF EXISTS idx_terms")
+    cursor.execute("DROP TABLE IF EXISTS idx")
+    cursor.execute(index_table_sql())
+    cursor.execute(TERMS_TABLE_SQL)
+    return True
+
+
+def normalize_text(text):
+    """Remove the combining marks of `text` (accents, Arabic harakat...), so
+    that "élève" matches "eleve" and vocalized Arabic matches unvocalized
+    Arabic, whatever the tokenizer of the index."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return unicodedata.normalize('NFC', u''.join(
+        c for c in decomposed if not unicodedata.combining(c)))
+
+
+# Built on first use by normalization_tables.
+_NORMALIZATION = {}
+
+
+def normalization_tables():
+    """Return a regexp matching the characters removed by normalize_text
+    (combining marks), and the characters it turns into each character (eg.
+    "é" and "ê" for "e")."""
+    if not _NORMALIZATION:
+        marks = []
+        variants = {}
+        for code in range(0x10000):
+            char = six.unichr(code)
+            if unicodedata.combining(char):
+                marks.append(char)
+                continue
+            normalized = normalize_text(char)
+            if normalized != char and len(normalized) == 1:
+                variants[normalized] = variants.get(normalized, u'') + char
+        _NORMALIZATION['marks'] = re.compile(
+            u'[{}]'.format(re.escape(u''.join(marks))))
+        _NORMALIZATION['variants'] = variants
+    return _NORMALIZATION['marks'], _NORMALIZATION['variants']
+
+
+def original_snippet(snippet, original, markers):
+    """Return `snippet`, cut by snippet() from the normalized text of
+    `original`, with the text of `original` (as it was before
+    normalize_text), so that it shows "élève" and not "eleve". The `markers`
+    inserted by snippet() (around the matching terms, at the cuts...) are
+    kept. Return None if `snippet` is not found in `original`.
+
+    `original` is only searched with a regexp built from the snippet, so
+    that the cost does not grow with the length of the text."""
+    marks_re, variants = normalization_tables()
+    chars = set(original)
+    # Only the marks and variants found in `original` keep the regexp short.
+    present = u''.join(set(marks_re.findall(original)))
+    marks = u'[{}]*'.format(re.escape(present)) if present else u''
+
+    def pattern(char):
+        alternatives = [c for c in variants.get(char, u'') if c in chars]
+        return u'[{}]{}'.format(re.escape(char + u''.join(alternatives)),
+                                marks)
+
+    parts = re.split(u'({})'.format(u'|'.join(map(re.escape, markers))),
+                     snippet)
+    # Text and markers alternate.
+    match = re.search(u''.join(u'({})'.format(u''.join(map(pattern, part)))
+                               for part in parts[::2]), original)
+    if match is None:
+        return None
+    parts[::2] = match.groups()
+    return u''.join(parts)
+
+
+# Levels of the segments of each of the FTS indexes (the full terms one,
+# then one per INDEX_PREFIXES) are stored in the same idx_segdir table.
+FTS_SEGDIR_MAXLEVEL = 1024
 
 
-def rank(match_info):
+def index_stats():
+    """Return the number of segments of the idx table, in total and by
+    level, and the size of their data, in bytes. Each prefix index has its
+    own segments."""
+    cursor = connection.cursor()
+    cursor.execute('SELECT level, COUNT(*), COALESCE(SUM(LENGTH(root)), 0) '
+                   'FROM idx_segdir GROUP BY level')
+    levels = {}
+    size = 0
+    for level, count, root_size in cursor.fetchall():
+        level %= FTS_SEGDIR_MAXLEVEL
+        levels[level] = levels.get(level, 0) + count
+        size += root_size
+    cursor.execute('SELECT COALESCE(SUM(LENGTH(block)), 0) FROM idx_segments')
+    size += cursor.fetchone()[0]
+    return {'segments': sum(levels.values()), 'levels': levels, 'size': size}
+
+
+def optimize_index():
+    """Merge all the segments of idx into one. Fastest index to query, but
+    it rewrites the whole index: prefer merge_index on a busy box."""
+    connection.cursor().execute("INSERT INTO idx(idx) VALUES('optimize')")
+
+
+def merge_index(pages=100, segments=8, max_seconds=None):
+    """Incrementally merge the segments of idx, by steps writing about
+    `pages` pages and merging at least `segments` segments of a level,
+    until there is nothing left to merge or after `max_seconds`. Return the
+    number of steps."""
+    cursor = connection.cursor()
+    sql = "INSERT INTO idx(idx) VALUES('merge={},{}')".format(
+        int(pages), int(segments))
+    start = time.time()
+    steps = 0
+    while True:
+        before = connection.connection.total_changes
+        cursor.execute(sql)
+        steps += 1
+        # Less than 2 rows written means there was nothing to merge.
+        if connection.connection.total_changes - before < 2:
+            break
+        if max_seconds is not None and time.time() - start >= max_seconds:
+            break
+    return steps
+
+
+def set_index_automerge(segments):
+    """Let SQLite merge `segments` segments of a level of idx whenever it is
+    written to; 0 disables it. The setting is stored in the index."""
+    connection.cursor().execute(
+        "INSERT INTO idx(idx) VALUES('automerge={}')".format(int(segments)))
+
+
+def check_index():
+    """Check the integrity of idx; raise a DatabaseError if corrupted."""
+    connection.cursor().execute(
+        "INSERT INTO idx(idx) VALUES('integrity-check')")
+
+
+def prefix_query(text, min_length=INDEX_PREFIXES[0]):
+    """Turn user input into a FTS query matching the words of `text`, the
+    last one being only the beginning of a word (eg. "the gre" gives
+    "the gre*"). Return an empty string when the last word is shorter than
+    `min_length`."""
+    words = re.findall(r'\w+', text, re.UNICODE)
+    if not words or len(words[-1]) < min_length:
+        return ''
+    return ' '.join(words[:-1] + [words[-1] + '*'])
+
+
+def index_digest(values):
+    """Hash of the index `values` of an instance, used to skip writing the
+    index when nothing changed."""
+    data = repr(sorted(values.items())).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def rank(match_info, *weights):
     # Handle match_info called w/default args 'pcx' - based on the example
     # rank function http://sqlite.org/fts3.html#appendix_a
     # From github.com/coleifer/peewee/master/playhouse/sqlite_ext.py
@@ -33,20 +231,29 @@ def rank(match_info):
     # - y is for the number of occurrences of the given word in all columns of
     #   all rows
     # - z is for the number of rows where the given word has been found
+    # Extra arguments are the weights of each column, in the order of the
+    # table definition; missing weights default to 1.
+    # This is called for every matching row, so the blob is unpacked in one
+    # call and the groups are walked with slices instead of Python loops.
     score = 0.0
     if not match_info:
         return score
-    bufsize = len(match_info)  # length in bytes
-    match_info = [struct.unpack('@I', match_info[i:i+4])[0]
-                  for i in range(0, bufsize, 4)]
-    p, c = match_info[:2]
-    for phrase_num in range(p):  # For earch word in the search query.
-        phrase_info_idx = 2 + (phrase_num * c * 3)
-        for col_num in range(c):  # For each searchable column.
-            col_idx = phrase_info_idx + (col_num * 3)
-            x1, x2 = match_info[col_idx:col_idx + 2]
-            if x1 > 0:
-                # The more hits in the column, the higher score (x1); the more
-                # rows containing the word in the index, the lower score (x2).
-                score += float(x1) / x2
+    match_info = struct.unpack('@{}I'.format(len(match_info) // 4),
+                               match_info)
+    c = match_info[1]
+    weights = (weights + (1.0, ) * c)[:c]
+    hits = match_info[2::3]
+    occurrences = match_info[3::3]
+    for x1, x2, weight in zip(hits, occurrences, cycle(weights)):
+        if x1 > 0 and weight:
+            # The more hits in the column, the higher score (x1); the more
+            # rows containing the word in the index, the lower score (x2).
+            score += weight * x1 / x2
     return score
+
+
+def rank_weights():
+    """Return the rank() weights of each column of the index, as configured
+    in settings.SEARCH_RANK_WEIGHTS."""
+    weights = settings.SEARCH_RANK_WEIGHTS
+    return [float(weights.get(name, 1.0)) for name in INDEX_COLUMNS]
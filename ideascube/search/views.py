@@ -1,18 +1,134 @@
-from django.shortcuts import render
-
-from .models import Search
-
-
-def search(request):
-    query = request.GET.get('q', '')
-    results = []
-    if query:
-        search_kwargs = {'text__match': query}
-        if not request.user.is_staff:
-            search_kwargs['public'] = True
-        results = Search.search(**search_kwargs)
-    context = {
-        'results': results,
-        'q': query
-    }
-    return render(request, 'search/search.html', context)
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.translation import get_language
+from django.views.generic import ListView
+
+from ideascube.decorators import staff_member_required
+
+from .cache import query_key, results_cache
+from .models import SEARCHABLE, Search, SearchResults
+from .spelling import suggest
+from .utils import FACET_COLUMNS, prefix_query
+
+
+class SearchView(ListView):
+    template_name = 'search/search.html'
+    context_object_name = 'results'
+    paginate_by = 20
+    max_paginate_by = 100
+    filter_names = FACET_COLUMNS + ('tag', )
+    suggestion = None
+
+    def get_paginate_by(self, queryset):
+        try:
+            size = int(self.request.GET.get('page_size', self.paginate_by))
+        except ValueError:
+            size = self.paginate_by
+        return max(1, min(size, self.max_paginate_by))
+
+    def get_filters(self):
+        return dict((name, self.request.GET[name])
+                    for name in self.filter_names
+                    if self.request.GET.get(name))
+
+    def get_queryset(self):
+        query = self.request.GET.get('q', '')
+        if not query:
+            return []
+        public = not self.request.user.is_staff
+        hydrate = settings.SEARCH_HYDRATE_RESULTS
+        results = Search.cached_search(query, public=public, hydrate=hydrate,
+                                       snippets=True, **self.get_filters())
+        if not results.count():
+            # Retry with the misspelled words corrected.
+            suggestion = results_cache.get_or_set(
+                ('spelling', query, public), lambda: suggest(query, public))
+            if suggestion:
+                corrected = Search.cached_search(
+                    suggestion, public=public, hydrate=hydrate, snippets=True,
+                    **self.get_filters())
+                if corrected.count():
+                    self.suggestion = suggestion
+                    results = corrected
+        return results
+
+    def get_facets(self, query):
+        facets = Search.cached_facets(query,
+                                      public=not self.request.user.is_staff,
+                                      **self.get_filters())
+        labels = {
+            'model': dict((name, model._meta.verbose_name_plural)
+                          for name, model in SEARCHABLE.items()),
+            'kind': {},
+            'lang': dict(settings.LANGUAGES),
+        }
+        for model in SEARCHABLE.values():
+            for field in model._meta.fields:
+                if field.name == 'kind':
+                    labels['kind'].update(field.choices)
+        # Do not alter the cached facets.
+        facets = dict((name, [dict(facet) for facet in values])
+                      for name, values in facets.items())
+        for name, values in facets.items():
+            param = 'tag' if name == 'tags' else name
+            for facet in values:
+                if name in labels:
+                    facet['label'] = labels[name].get(facet['value'],
+                                                      facet['value'])
+                facet['url'] = self.filter_url(param, facet['value'])
+        return facets
+
+    def filter_url(self, name, value):
+        """URL of the first page of results, filtered by `name`=`value`."""
+        get = self.request.GET.copy()
+        get.pop('page', None)
+        get[name] = value
+        return '?{}'.format(get.urlencode())
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '')
+        context['filters'] = [
+            {'name': name, 'value': value, 'url': self.filter_url(name, '')}
+            for name, value in sorted(self.get_filters().items())]
+        context['suggestion'] = self.suggestion
+        if context['q']:
+            context['facets'] = self.get_facets(self.suggestion or
+                                                context['q'])
+        return context
+
+search = SearchView.as_view()
+
+
+AUTOCOMPLETE_LIMIT = 10
+
+
+def autocomplete_results(query, public):
+    """The AUTOCOMPLETE_LIMIT most relevant results for the prefix `query`
+    (see prefix_query), as dicts."""
+    hits = SearchResults(Search.matching(query, public), hydrate=False)
+    return [{
+        'label': str(hit),
+        'url': hit.get_absolute_url(),
+        'model': hit.model,
+        'preview': hit.preview,
+    } for hit in hits[:AUTOCOMPLETE_LIMIT]]
+
+
+def autocomplete(request):
+    """Return, as JSON, the 10 most relevant results for the beginning of a
+    query, eg. while it is being typed."""
+    query = prefix_query(request.GET.get('q', ''))
+    if not query:
+        return JsonResponse({'results': []})
+    public = not request.user.is_staff
+    key = ('autocomplete', get_language()) + query_key(query, public)
+    results = results_cache.get_or_set(
+        key, lambda: autocomplete_results(query, public))
+    return JsonResponse({'results': results})
+
+
+@staff_member_required
+def cache_stats(request):
+    """Hit and miss counters of the search results cache of this process."""
+    return JsonResponse(results_cache.stats())
@@ -23,6 +23,12 @@ ID.http = {
         return ID.http._ajax(options);
     },
 
+    post: function (uri, options) {
+        options.verb = 'POST';
+        options.uri = uri;
+        return ID.http._ajax(options);
+    },
+
     queryString: function (params) {
         var queryString = [];
         for (var key in params) {
@@ -267,6 +273,46 @@ ID.confirmClick = function (selector) {
 };
 
 
+ID.initInventoryScan = function (selector, uri) {
+    var form = document.querySelector(selector);
+    if (!form) return;
+    var input = form.querySelector('[name="specimen"]');
+    var errors = document.createElement('ul');
+    errors.className = 'errorlist';
+    form.appendChild(errors);
+    var scan = function (e) {
+        e.preventDefault();
+        var single = input.value.trim().split(/\s+/).length === 1;
+        var data = new window.FormData();
+        data.append('csrfmiddlewaretoken', form.querySelector('[name="csrfmiddlewaretoken"]').value);
+        data.append('barcode', input.value);
+        ID.http.post(uri, {data: data, callback: function (status, text) {
+            var response = status === 200 ? JSON.parse(text) : null;
+            if (!response || (single && response.unknown.length)) {
+                // Let the regular form display the error.
+                form.removeEventListener('submit', scan, false);
+                return form.submit();
+            }
+            response.rows.forEach(function (row) {
+                var element = document.getElementById('specimen-' + row.specimen);
+                if (element) element.outerHTML = row.html;
+            });
+            // The known bar codes of a batch are recorded: only keep the
+            // unknown ones, to be fixed.
+            errors.innerHTML = '';
+            if (response.error) {
+                var error = document.createElement('li');
+                error.textContent = response.error;
+                errors.appendChild(error);
+            }
+            input.value = response.unknown.join(' ');
+            input.focus();
+        }});
+    };
+    form.addEventListener('submit', scan, false);
+};
+
+
 ID.initWifiList = function (item_selector, popup_selector, urlroot) {
     var elements = document.querySelectorAll(item_selector);
 
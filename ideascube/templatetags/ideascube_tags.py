@@ -25,9 +25,10 @@ THEMES = {
 @register.filter(is_safe=True)
 def theme_slug(inst, slug=None):
     tpl = '<span class="theme {klass}">{slug}</span>'
-    name = inst.__class__.__name__
+    # Search hits rendered from the index tell which model they come from.
+    name = getattr(inst, 'theme_name', inst.__class__.__name__)
     if not slug:
-        slug = getattr(inst, 'slug', SLUGS.get(name, name.lower()))
+        slug = getattr(inst, 'slug', None) or SLUGS.get(name, name.lower())
     klass = THEMES.get(name, slug)
     return mark_safe(tpl.format(klass=klass, slug=slug))
 
@@ -13,7 +13,7 @@ from ideascube.blog.models import Content
 from ideascube.library.tests.factories import BookSpecimenFactory
 
 from .factories import UserFactory
-from ..views import ByTag, UserList
+from ..views import ByTag, UserExport, UserList
 
 pytestmark = pytest.mark.django_db
 user_model = get_user_model()
@@ -338,6 +338,18 @@ def test_export_users_should_return_csv_with_users(staffapp, settings):
             ])
 
 
+def test_export_users_is_streamed(staffapp):
+    UserFactory.create_batch(3)
+    resp = staffapp.get(reverse('user_export'), status=200)
+    assert resp.content_type == 'text/csv'
+    assert 'attachment' in resp.headers['Content-Disposition']
+    # Header, 3 users and the staff user.
+    assert len(resp.text.strip().splitlines()) == 5
+    response = UserExport().render_to_csv()
+    assert response.streaming
+    assert b''.join(response.streaming_content) == resp.body
+
+
 def test_export_users_should_be_ok_in_arabic(staffapp, settings):
     translation.activate('ar')
     user1 = UserFactory(serial="جبران خليل جبران")
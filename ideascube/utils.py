@@ -1,5 +1,15 @@
 
 
+# Stay below the SQLite limit of 999 parameters per query.
+BATCH_SIZE = 500
+
+
+def batches(values, size=BATCH_SIZE):
+    """Split the `values` list in lists of at most `size` values."""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
 class classproperty(property):
     """
     Use it to decorate a classmethod to make it a "class property".